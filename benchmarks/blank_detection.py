@@ -0,0 +1,60 @@
+"""
+Compare blank page detection against the old per-pixel Python check
+
+    python benchmarks/blank_detection.py [page.png ...]
+
+Without arguments, synthetic pages at viewer sizes are used.
+"""
+import sys
+import timeit
+from pathlib import Path
+from PIL import Image, ImageDraw
+from bookphucker.imaging import looks_unloaded
+
+
+def legacy_is_blank(img: Image.Image) -> bool:
+    return all(all(v == 0 for v in c) for c in img.getdata())
+
+
+def is_blank(img: Image.Image) -> bool:
+    """
+    Whether every band of every pixel is zero, i.e. the canvas was never drawn on
+    """
+    extrema = img.getextrema()
+    if len(img.getbands()) == 1:
+        extrema = (extrema,)  # type: ignore[assignment]
+    return all(high == 0 for _, high in extrema)  # type: ignore[misc]
+
+
+def synthetic_pages() -> dict[str, Image.Image]:
+    pages = dict[str, Image.Image]()
+    for w, h in [(1440, 1440), (2880, 2048)]:
+        pages[f"blank {w}x{h}"] = Image.new("RGBA", (w, h))
+        page = Image.new("RGBA", (w, h), (255, 255, 255, 255))
+        draw = ImageDraw.Draw(page)
+        for y in range(60, h - 60, 40):
+            draw.line((60, y, w - 60, y), fill=(0, 0, 0, 255), width=12)
+        pages[f"text {w}x{h}"] = page
+        partial = Image.new("RGBA", (w, h))  # only the last strip has been drawn
+        partial.paste(page.crop((0, h - h // 100, w, h)), (0, h - h // 100))
+        pages[f"partial {w}x{h}"] = partial
+    return pages
+
+
+def main():
+    if len(sys.argv) > 1:
+        pages = {Path(p).name: Image.open(p).convert("RGBA") for p in sys.argv[1:]}
+    else:
+        pages = synthetic_pages()
+    print(f"{'page':<24}{'legacy':>12}{'is_blank':>12}{'unloaded':>12}")
+    for name, img in pages.items():
+        img.load()
+        times = [min(timeit.repeat(lambda: f(img), number=1,
+                                   repeat=3 if f is legacy_is_blank else 20))
+                 for f in (legacy_is_blank, is_blank, looks_unloaded)]
+        assert legacy_is_blank(img) == is_blank(img)
+        print(f"{name:<24}" + "".join(f"{t * 1000:>10.2f}ms" for t in times))
+
+
+if __name__ == "__main__":
+    main()
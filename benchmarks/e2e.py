@@ -0,0 +1,208 @@
+"""
+Run `jp.download_book` and `tw.download_book` headless against the local fake viewer
+and report throughput, per-phase latency and CPU time
+
+    python benchmarks/e2e.py [-r jp tw] [--books 2] [--pages 40] [--json out.json]
+    python benchmarks/e2e.py --baseline out.json  # fail on a throughput regression
+
+Needs Chrome or Chromium, as configured by `config.json` if present.
+"""
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import statistics
+import ujson as json
+from pathlib import Path
+from uuid import uuid4
+from typing import Callable
+from fake_viewer import FakeViewer, add_viewer_arguments, viewer_options
+from bookphucker import Config, jp, tw, pipeline, tabs
+from bookphucker.catalog import Catalog
+from bookphucker.commonvars import catalog_path, config_path
+from bookphucker.resolve import ProductCache, products_path
+
+SITES = {"jp": jp, "tw": tw}
+
+
+class Timings:
+    def __init__(self):
+        self.phases = dict[str, list[float]]()
+        self.lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float):
+        with self.lock:
+            self.phases.setdefault(phase, []).append(seconds)
+
+    def wrap(self, phase: str, func: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            begin = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(phase, time.perf_counter() - begin)
+        return timed
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        result = dict[str, dict[str, float]]()
+        for phase, samples in self.phases.items():
+            samples = sorted(samples)
+            result[phase] = {
+                "count": len(samples),
+                "mean_ms": statistics.fmean(samples) * 1000,
+                "p50_ms": samples[len(samples) // 2] * 1000,
+                "p95_ms": samples[min(len(samples) - 1,
+                                      int(len(samples) * 0.95))] * 1000,
+            }
+        return result
+
+
+def renderer_cpu(driver) -> dict[str, float]:
+    metrics = {m["name"]: m["value"] for m in
+               driver.execute_cdp_cmd("Performance.getMetrics", {})["metrics"]}
+    return {"task_s": metrics.get("TaskDuration", 0),
+            "script_s": metrics.get("ScriptDuration", 0)}
+
+
+def bench_region(cfg: Config, region: str, books: int, work_dir: Path) -> dict:
+    site = SITES[region]
+    timings = Timings()
+    capture, process = tabs.capture, pipeline.process_capture
+    book = {"started": 0.0, "opened": False}
+
+    def timed_capture(*args, **kwargs):
+        if not book["opened"]:
+            book["opened"] = True
+            timings.add("open", time.perf_counter() - book["started"])
+        return timings.wrap("capture", capture)(*args, **kwargs)
+    tabs.capture = timed_capture
+    pipeline.process_capture = timings.wrap("process", process)
+
+    driver = cfg.get_webdriver(work_dir / f"profile-{region}")
+    pages = 0
+    renderer = {"task_s": 0.0, "script_s": 0.0}
+    last = dict[str, dict[str, float]]()  # renderer metrics are cumulative per tab
+    try:
+        started, cpu_started = time.perf_counter(), time.process_time()
+        for _ in range(books):
+            book_uuid = str(uuid4())
+            book.update(started=time.perf_counter(), opened=False)
+            timings.wrap("book", site.download_book)(
+                driver, cfg, book_uuid, True, cookies_file=work_dir / "cookies.json")
+            driver.execute_cdp_cmd("Performance.enable", {})
+            now = renderer_cpu(driver)
+            before = last.get(driver.current_window_handle, {})
+            for k, v in now.items():
+                # a new renderer process starts counting from zero again
+                renderer[k] += v - before.get(k, 0) if v >= before.get(k, 0) else v
+            last[driver.current_window_handle] = now
+            book_dir = site.books_path / f"Benchmark {book_uuid[:8]}"
+            pages += len(list(book_dir.glob("page_*")))
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+    finally:
+        driver.quit()
+        tabs.capture, pipeline.process_capture = capture, process
+    return {
+        "books": books,
+        "pages": pages,
+        "seconds": elapsed,
+        "pages_per_second": pages / elapsed if elapsed else 0,
+        "phases": timings.summary(),
+        "cpu": {"python_s": cpu, "renderer_task_s": renderer["task_s"],
+                "renderer_script_s": renderer["script_s"]},
+    }
+
+
+def report(results: dict[str, dict]):
+    for region, r in results.items():
+        print(f"{region}: {r['pages']} pages of {r['books']} books"
+              f" in {r['seconds']:.2f}s, {r['pages_per_second']:.2f} pages/s")
+        for phase, p in r["phases"].items():
+            print(f"  {phase:<8} n={p['count']:<5} mean {p['mean_ms']:8.1f} ms"
+                  f"  p50 {p['p50_ms']:8.1f} ms  p95 {p['p95_ms']:8.1f} ms")
+        cpu = r["cpu"]
+        print(f"  cpu      python {cpu['python_s']:.2f}s"
+              f"  renderer {cpu['renderer_task_s']:.2f}s"
+              f" (script {cpu['renderer_script_s']:.2f}s)")
+
+
+def regressions(results: dict[str, dict], baseline: dict[str, dict], tolerance: float
+                ) -> list[str]:
+    failed = list[str]()
+    for region, r in results.items():
+        if region not in baseline:
+            continue
+        expected = baseline[region]["pages_per_second"] * (1 - tolerance)
+        if r["pages_per_second"] < expected:
+            failed.append(f"{region}: {r['pages_per_second']:.2f} pages/s, "
+                          f"expected at least {expected:.2f}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--regions", nargs='+', default=["jp", "tw"],
+                        choices=["jp", "tw"])
+    parser.add_argument("--books", help="Books per region", type=int, default=2)
+    parser.add_argument("--json", help="Write the results to this file", type=Path)
+    parser.add_argument("--baseline", help="Results to compare throughput against",
+                        type=Path)
+    parser.add_argument("--tolerance",
+                        help="Allowed throughput drop against the baseline",
+                        type=float, default=0.1)
+    parser.add_argument("--headful", help="Show the browser", action="store_true")
+    parser.add_argument("--tabs", help="Viewers sharing the pages of each book",
+                        type=int, default=1)
+    parser.add_argument("--transport", help="How captured pages leave the browser",
+                        default="png", choices=["png", "webp", "rgba"])
+    parser.add_argument("--no-precheck",
+                        help="Send every frame, even blank or unchanged ones",
+                        action="store_true")
+    add_viewer_arguments(parser)
+    args = parser.parse_args()
+
+    cfg = Config()
+    if config_path.exists():
+        cfg, _ = Config.from_dict(json.loads(config_path.read_text(encoding="utf-8")))
+    cfg.headless = not args.headful
+    cfg.tabs = args.tabs
+    cfg.transport = args.transport
+    cfg.precheck = not args.no_precheck
+
+    viewer = FakeViewer(viewer_options(args)).start()
+    results = dict[str, dict]()
+    with tempfile.TemporaryDirectory(prefix="bookphucker-bench-") as tmp:
+        work_dir = Path(tmp)
+        # keep downloads and cached book info out of the real directories
+        jp.member_url = tw.store_url = viewer.url
+        jp.books_path = tw.books_path = work_dir / "books"
+        ProductCache._caches[products_path] = ProductCache(
+            work_dir / "tw_products.json")
+        Catalog._catalogs[catalog_path] = Catalog(work_dir / "catalog.sqlite3")
+        try:
+            for region in args.regions:
+                results[region] = bench_region(cfg, region, args.books, work_dir)
+        finally:
+            viewer.stop()
+
+    report(results)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        failed = regressions(results, baseline, args.tolerance)
+        for line in failed:
+            print(f"Regression {line}", file=sys.stderr)
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+"""
+Local stand-in for the store pages and the NFBR reader, enough for
+`jp.download_book` and `tw.download_book` to run against
+
+    python benchmarks/fake_viewer.py [--port 8421] [--pages 40] [--delay 80] ...
+
+Point the site modules at it with
+
+    jp.member_url = "http://127.0.0.1:8421"
+    tw.store_url = "http://127.0.0.1:8421"
+
+Every book has the same number of pages, titles are derived from the UUID.
+The reader draws each page after `delay` ± `jitter` ms. With probability `blank`
+it first shows an empty canvas, and with probability `stale` it keeps the previous
+page on screen, hiding the loading overlay before the real page is drawn.
+With `fit`, pages are letterboxed into a canvas as large as the window
+and drawn again when it is resized, as the real reader does.
+"""
+import argparse
+import threading
+import ujson as json
+from dataclasses import dataclass, asdict
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# the reader is served under a path containing the tw reader host,
+# `tw.download_book` waits for the url to contain it
+TW_READER = "/pcreader.bookwalker.com.tw/viewer/"
+JP_READER = "/viewer/"
+
+
+@dataclass
+class ViewerOptions:
+    pages: int = 40
+    width: int = 1440
+    height: int = 2048
+    delay: float = 80  # ms between a page move and the page being drawn
+    jitter: float = 40
+    blank: float = 0.05  # chance of an empty frame before the page is drawn
+    stale: float = 0.05  # chance of the previous page staying up for a while
+    seed: int = 1
+    fit: bool = False  # canvas sized to the window, pages of width x height letterboxed
+
+
+READER_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title>
+<style>
+body {{ margin: 0; background: #222; }}
+.currentScreen canvas {{ display: block; max-width: 100vw; max-height: 100vh; }}
+.loading {{ position: fixed; top: 0; left: 0; right: 0; padding: 8px;
+            background: #000a; color: #fff; }}
+</style></head>
+<body>
+<div class="progressbar">Loading…</div>
+<div class="loading">Loading…</div>
+<div class="currentScreen"><canvas></canvas></div>
+<div id="pageSliderCounter"></div>
+<script>
+const opts = {options};
+// mulberry32, so runs with the same seed show the same glitches
+let state = opts.seed >>> 0;
+const random = () => {{
+    state = (state + 0x6D2B79F5) >>> 0;
+    let t = state;
+    t = Math.imul(t ^ t >>> 15, t | 1);
+    t ^= t + Math.imul(t ^ t >>> 7, t | 61);
+    return ((t ^ t >>> 14) >>> 0) / 4294967296;
+}};
+const canvas = document.querySelector('.currentScreen canvas');
+const resize = () => {{
+    canvas.width = opts.fit ? Math.round(innerWidth * devicePixelRatio) : opts.width;
+    canvas.height = opts.fit ? Math.round(innerHeight * devicePixelRatio) : opts.height;
+}};
+resize();
+const ctx = canvas.getContext('2d');
+const loading = document.querySelector('.loading');
+const counter = document.getElementById('pageSliderCounter');
+
+// cover on its own, then two pages per spread
+const spreads = [{{pageIndex: 0}}];
+for (let p = 1; p < opts.pages; p += 2) spreads.push({{pageIndex: p}});
+const spreadOf = page => page === 0 ? 0 : Math.floor((page + 1) / 2);
+
+const render = page => {{
+    // pages are drawn off screen and copied over, like the real reader does
+    const off = document.createElement('canvas');
+    off.width = opts.width;
+    off.height = opts.height;
+    const c = off.getContext('2d');
+    c.fillStyle = '#fff';
+    c.fillRect(0, 0, off.width, off.height);
+    c.fillStyle = '#000';
+    let s = (page + 1) * 2654435761 >>> 0;
+    for (let y = 120; y < off.height - 120; y += 48) {{
+        s = Math.imul(s ^ s >>> 13, 1274126177) >>> 0;
+        c.fillRect(80 + s % 200, y, off.width - 160 - (s >>> 8) % 600, 20);
+    }}
+    c.font = `${{opts.width / 8}}px sans-serif`;
+    c.fillText(String(page + 1), opts.width / 3, opts.height / 2);
+    if (!opts.fit) {{
+        ctx.drawImage(off, 0, 0);
+        return;
+    }}
+    const scale = Math.min(canvas.width / off.width, canvas.height / off.height);
+    const w = off.width * scale, h = off.height * scale;
+    ctx.fillStyle = '#000';
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+    ctx.drawImage(off, (canvas.width - w) / 2, (canvas.height - h) / 2, w, h);
+}};
+
+let current = -1;
+let pending = null;
+const moveToPage = page => {{
+    page = Math.max(0, Math.min(opts.pages - 1, page));
+    clearTimeout(pending);
+    loading.style.visibility = 'visible';
+    const delay = Math.max(0, opts.delay + (random() * 2 - 1) * opts.jitter);
+    const blank = random() < opts.blank;
+    const stale = !blank && current >= 0 && random() < opts.stale;
+    pending = setTimeout(() => {{
+        current = page;
+        counter.innerText = `${{page + 1}}/${{opts.pages}}`;
+        if (blank) {{
+            ctx.clearRect(0, 0, canvas.width, canvas.height);
+        }} else if (!stale) {{
+            render(page);
+        }}
+        loading.style.visibility = 'hidden';
+        if (blank || stale) {{
+            pending = setTimeout(() => render(page), delay * 4);
+        }}
+    }}, delay);
+}};
+
+window.NFBR = {{a6G: {{Initializer: {{L7v: {{menu: {{
+    model: {{attributes: {{
+        a2u: {{r8q: spreads}},
+        viewera6e: {{getSpreadIndex: () => current < 0 ? -1 : spreadOf(current)}},
+    }}}},
+    options: {{a6l: {{moveToPage}}}},
+}}}}}}}}}};
+
+addEventListener('resize', () => {{
+    if (opts.fit) {{
+        resize();
+        if (current >= 0) setTimeout(() => render(current), opts.delay);
+    }}
+}});
+
+setTimeout(() => {{
+    document.querySelector('.progressbar').style.display = 'none';
+    moveToPage(0);
+}}, opts.delay);
+</script>
+</body></html>
+"""
+
+JP_STORE_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title></head>
+<body>
+<button class="gdpr-accept" onclick="this.remove()">OK</button>
+<h1 class="t-c-product-main-data__title">{title}</h1>
+<dl class="t-c-product-main-data__authors"><dt>著</dt><dd>{author}</dd></dl>
+<a class="t-c-read-button" href="#"
+   onclick="window.open('{reader}?cid={uuid}'); return false;">読む</a>
+</body></html>
+"""
+
+TW_TRIAL_END_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title>
+<meta property="og:url" content="{base}/product/{product_id}">
+</head>
+<body><div class="writer_data"><span>{author}</span></div></body></html>
+"""
+
+
+def book_title(book_uuid: str) -> str:
+    return f"Benchmark {book_uuid[:8]}"
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: "FakeViewer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status: int, body: str = "", headers: dict[str, str] | None = None):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        base = f"http://{self.headers['Host']}"
+        redirect = query.get("r", "")
+        match parts:
+            case ["app", "03", "webstore", "cooperation"] if redirect.startswith("de"):
+                book_uuid = query["r"][2:].strip("/")
+                self.reply(200, JP_STORE_HTML.format(
+                    title=escape(book_title(book_uuid)), author="Fixture",
+                    reader=JP_READER, uuid=book_uuid))
+            case ["browserViewer", book_uuid, "trial_end"]:
+                self.reply(200, TW_TRIAL_END_HTML.format(
+                    title=escape(book_title(book_uuid)), author="Fixture",
+                    base=base, product_id=f"p{book_uuid}"))
+            case ["browserViewer", product_id, "read"]:
+                self.reply(302, headers={
+                    "Location": f"{TW_READER}?cid={product_id.removeprefix('p')}"})
+            case [*_, "viewer"]:
+                options = asdict(self.server.options)
+                for k, v in query.items():
+                    if isinstance(options.get(k), bool):
+                        options[k] = v.lower() in ("1", "true", "yes")
+                    elif k in options:
+                        options[k] = type(options[k])(v)
+                self.reply(200, READER_HTML.format(
+                    title=escape(book_title(query.get("cid", ""))),
+                    options=json.dumps(options)))
+            case _:
+                self.reply(404, "not found")
+
+
+class FakeViewer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, options: ViewerOptions, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), Handler)
+        self.options = options
+        self.host = host
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.server_port}"
+
+    def start(self) -> "FakeViewer":
+        threading.Thread(target=self.serve_forever, name="fake-viewer",
+                         daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def add_viewer_arguments(parser: argparse.ArgumentParser):
+    defaults = ViewerOptions()
+    parser.add_argument("--pages", help="Pages per book", type=int,
+                        default=defaults.pages)
+    parser.add_argument("--size", help="Canvas size", type=int, nargs=2,
+                        default=[defaults.width, defaults.height])
+    parser.add_argument("--delay", help="Render delay in ms", type=float,
+                        default=defaults.delay)
+    parser.add_argument("--jitter", help="Render delay jitter in ms",
+                        type=float, default=defaults.jitter)
+    parser.add_argument("--blank", help="Chance of an empty frame", type=float,
+                        default=defaults.blank)
+    parser.add_argument("--stale", help="Chance of the previous page staying on screen",
+                        type=float, default=defaults.stale)
+    parser.add_argument("--seed", help="Seed of the glitches", type=int,
+                        default=defaults.seed)
+    parser.add_argument("--fit",
+                        help="Letterbox --size pages in a canvas sized to the window",
+                        action="store_true")
+
+
+def viewer_options(args: argparse.Namespace) -> ViewerOptions:
+    return ViewerOptions(pages=args.pages, width=args.size[0], height=args.size[1],
+                         delay=args.delay, jitter=args.jitter, blank=args.blank,
+                         stale=args.stale, seed=args.seed, fit=args.fit)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8421)
+    add_viewer_arguments(parser)
+    args = parser.parse_args()
+    server = FakeViewer(viewer_options(args), port=args.port)
+    print(f"Serving on {server.url}")
+    print(f"  jp: {server.url}/app/03/webstore/cooperation?r=de<uuid>%2F")
+    print(f"  tw: {server.url}/browserViewer/<uuid>/trial_end")
+    server.serve_forever()
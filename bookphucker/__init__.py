@@ -1 +1,14 @@
-from config import Config
\ No newline at end of file
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .config import Config
+
+__all__ = ["Config"]
+
+
+def __getattr__(name: str):
+    # pydantic takes a while to import, load the config only once it is used
+    if name == "Config":
+        from .config import Config
+        return Config
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,68 +1,111 @@
+import time
 import argparse
 import sys
 import ujson as json
 import logging
-import requests
 from shutil import move, rmtree
-from urllib.parse import urlparse
 from getpass import getpass
 from pathlib import Path
 from contextlib import suppress
-from selenium.common.exceptions import WebDriverException, TimeoutException
-from bookphucker import Config
-from bookphucker.exc import RequiresCapcha
-from bookphucker.commonvars import config_path, cache_path
+from typing import TYPE_CHECKING
+# the package, selenium, requests and the site modules are imported once they are
+# needed, so that --profile-startup sees the time they take
+if TYPE_CHECKING:
+    from bookphucker.profiling import PhaseTimer
+
+started = time.perf_counter()
+
+# subcommands as `module[:function]`, the function defaults to `main(argv)`
+COMMANDS = {
+    "export": "bookphucker.export",
+    "ocr": "bookphucker.ocr",
+    "process": "bookphucker.process",
+    "search": "bookphucker.ocr:search_main",
+    "serve": "bookphucker.server",
+    "submit": "bookphucker.server:submit_main",
+    "jobs": "bookphucker.server:jobs_main",
+}
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        from importlib import import_module
+        module, _, func = COMMANDS[sys.argv[1]].partition(":")
+        return getattr(import_module(module), func or "main")(sys.argv[2:])
+
     parser = argparse.ArgumentParser()
-    parser.add_argument("book_pages", help="The page url or book uuid", nargs='+')
+    parser.add_argument("book_pages", help="The page url or book uuid", nargs='*')
+    parser.add_argument("-i", "--input",
+                        help="Read page urls or book uuids from a file, "
+                        "one per line ('-' for stdin)",
+                        action="append", default=[])
     parser.add_argument("-r", "--region", help="The region of the bookwalker site",
                         default="auto", choices=["jp", "tw", "auto"])
     parser.add_argument("--no-cache", help="Clear cache directory (cookies, etc.)",
                         action="store_true")
     parser.add_argument("--overwrite", help="Overwrite existing files",
                         action="store_true")
+    parser.add_argument("--verify",
+                        help="Re-hash saved pages, fetch missing or changed ones again",
+                        action="store_true")
+    parser.add_argument("-w", "--workers",
+                        help="Number of browser sessions downloading in parallel, "
+                        "defaults to one per account in the config",
+                        type=int, default=0)
+    parser.add_argument("-t", "--tabs",
+                        help="Number of viewers sharing the pages of each book",
+                        type=int)
+    parser.add_argument("--profile-startup",
+                        help="Report the time spent in each startup phase",
+                        action="store_true")
 
     args = parser.parse_args()
+    if not args.book_pages and not args.input:
+        parser.error("no books given")
+    from bookphucker.profiling import PhaseTimer
+    timer = PhaseTimer(args.profile_startup, started)
+    timer.mark("imports and arguments")
+    try:
+        return download(args, timer)
+    finally:
+        timer.report()
+
+
+def download(args: argparse.Namespace, timer: "PhaseTimer"):
+    from bookphucker.resolve import resolve_books, read_book_list
     book_uuids = list[str]()
     region = args.region
 
     print(f"Book UUIDs:\n\n")
 
-    for book_page in args.book_pages:
-        if "bookwalker" in book_page:
-            if not book_page.startswith("http"):
-                book_page = "https://" + book_page
-            book_url = urlparse(book_page)
-            if ".jp" in book_url.hostname:
-                if region == "auto":
-                    region = "jp"
-                book_uuid = book_url.path
-                print(f"{book_uuid}")
-            elif ".com.tw" in book_url.hostname:
-                if region == "auto":
-                    region = "tw"
-                book_id = ''
-                if book_url.path.startswith("/product/"):
-                    book_id = book_url.path.removeprefix("/product/").split("/")[0]
-                    r = requests.head(
-                        f"https://www.bookwalker.com.tw/browserViewer/{book_id}/trial")
-                    book_url = urlparse(r.headers["Location"])
-                query = book_url.query
-                book_uuid = dict([param.split("=")
-                                 for param in query.split("&")])["cid"]
-                print(f"{book_uuid}{f" ({book_id})" if book_id else ''}")
-        else:
-            book_uuid = book_page
-            print(f"{book_uuid}")
-        book_uuids.append(book_uuid.strip('/')[-36:])
+    book_pages = args.book_pages + read_book_list(args.input)
+    for book_uuid, book_region, book_id in resolve_books(book_pages):
+        if region == "auto" and book_region:
+            region = book_region
+        print(f"{book_uuid} ({book_id})" if book_id else book_uuid)
+        book_uuids.append(book_uuid)
+    timer.mark("resolve books")
+
+    if not (args.overwrite or args.verify):
+        from bookphucker.catalog import Catalog
+        completed = Catalog.open().completed(book_uuids)
+        if completed:
+            print(f"Skipping {len(completed)} books already downloaded")
+            book_uuids = [b for b in book_uuids if b not in completed]
+        timer.mark("check catalog")
+        if not book_uuids:
+            return 0
 
+    from bookphucker import Config
+    from bookphucker.exc import RequiresCapcha
+    from bookphucker.commonvars import config_path, cache_path
+    from selenium.common.exceptions import WebDriverException
     match region:
         case "jp" | "auto":
-            from bookphucker.jp import login, download_book, logout
+            from bookphucker import jp as site
         case "tw":
-            from bookphucker.tw import login, download_book, logout
+            from bookphucker import tw as site
+    timer.mark("import site modules")
 
     cfg = Config()
 
@@ -86,21 +129,40 @@ def main():
                 json.dumps(cfg.model_dump(mode="json"), indent=2), encoding = "utf-8")
             print(f"Config file updated at {config_path}")
 
+    if args.tabs:
+        cfg.tabs = args.tabs
+
     if args.no_cache and cache_path.exists():
         rmtree(cache_path)
         cache_path.mkdir()
         print(f"Cache directory cleared at {cache_path}")
+    timer.mark("load config")
 
-    driver = cfg.get_webdriver()
+    if args.workers > 1 or cfg.accounts:
+        cfg.config_logging()
+        # the accounts in the config are enough, unless there is a main one too
+        prompt = not cfg.manual_login and bool(cfg.username or not cfg.accounts)
+        username = (cfg.username or input("Enter your username: ")) if prompt else ''
+        password = (cfg.password or getpass("Enter your password: ")) if prompt else ''
+        from bookphucker.pool import download_books
+        with timer.phase("download"):
+            failures = download_books(cfg, book_uuids, args.workers, site,
+                                      username, password, overwrite=args.overwrite,
+                                      verify=args.verify)
+        for book_uuid, e in failures.items():
+            logging.error("Failed to download %s: %r", book_uuid, e)
+        return 1 if failures else 0
+
+    with timer.phase("start browser"):
+        driver = cfg.get_webdriver()
     cfg.config_logging()
+    supervisor = None
 
     try:
         username = '' if cfg.manual_login else (
             cfg.username or input("Enter your username: "))
         password = '' if cfg.manual_login else (
             cfg.password or getpass("Enter your password: "))
-        max_login_retries = 1
-        login_retry = 0
         manual_login = cfg.manual_login or not any([username, password])
         if manual_login and cfg.headless:
             print("Manual login required, but browser is headless.")
@@ -110,46 +172,55 @@ def main():
                 driver.quit()
                 cfg.headless = False
                 driver = cfg.get_webdriver()
-        while True:
-            try:
-                login(driver, username, password, error_on_captcha=cfg.headless)
-            except RequiresCapcha:
-                print("Captcha required, but browser is headless.")
-                user_input = input(
-                    "Would you like to continue with non-headless browser? (y/N) ").strip().lower() or "y"
-                if user_input != "y":
-                    return 2
-                driver.quit()
-                cfg.headless = False
-                driver = cfg.get_webdriver()
-                login(driver, username, password)
-
-            try:
-                for book_uuid in book_uuids:
-                    download_book(driver, cfg, book_uuid, overwrite=args.overwrite)
-            except TimeoutException:
-                if "ERROR998" in driver.page_source:
-                    logging.error("Error 998: Must log out from another device")
-                    login_retry += 1
-                    if login_retry > max_login_retries:
-                        raise
-                    logging.warning("Retrying login %s/%s", login_retry, max_login_retries)
-                    logout(driver)
-                    continue
-                else:
+        try:
+            with timer.phase("login"):
+                site.login(driver, username, password, error_on_captcha=cfg.headless)
+        except RequiresCapcha:
+            print("Captcha required, but browser is headless.")
+            user_input = input(
+                "Would you like to continue with non-headless browser? (y/N) "
+            ).strip().lower() or "y"
+            if user_input != "y":
+                return 2
+            driver.quit()
+            cfg.headless = False
+            driver = cfg.get_webdriver()
+            site.login(driver, username, password)
+
+        # restarts the browser and retries books when they fail, the batch goes on
+        from bookphucker.supervisor import Supervisor
+        supervisor = Supervisor(cfg, site, username, password, driver=driver)
+        failures = dict[str, BaseException]()
+        for book_uuid in book_uuids:
+            with timer.phase(f"download {book_uuid}"):
+                try:
+                    supervisor.download(book_uuid, args.overwrite, args.verify)
+                except RequiresCapcha:
                     raise
-            break
+                except Exception as e:
+                    logging.error("Failed to download %s: %r, see error-%s.html",
+                                  book_uuid, e, book_uuid)
+                    failures[book_uuid] = e
+        return 1 if failures else 0
     except Exception as e:
-        Path("error.html").write_text(driver.page_source, encoding = "utf-8")
-        Path("error.png").write_bytes(driver.get_screenshot_as_png())
+        # the supervisor may have restarted the browser, or lost it for good,
+        # never hide the error behind one from the dump
+        current = driver if supervisor is None else supervisor.driver
+        with suppress(Exception):
+            if current is not None:
+                Path("error.html").write_text(current.page_source, encoding = "utf-8")
+                Path("error.png").write_bytes(current.get_screenshot_as_png())
         logging.error(
             "An error occurred. Please check error.html and error.png for more information.")
         raise e
     except KeyboardInterrupt:
         print("Exiting...")
     finally:
-        with suppress(WebDriverException):
-            driver.quit()
+        if supervisor is not None:
+            supervisor.quit()  # its browser may have been restarted
+        else:
+            with suppress(WebDriverException):
+                driver.quit()
 
 
 sys.exit(main())
@@ -0,0 +1,112 @@
+import re
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from shutil import copyfile
+from .commonvars import cache_path, cookies_path
+from .config import Account, Config
+
+accounts_path = cache_path / "accounts"
+
+
+def namespace(region: str, username: str) -> Path:
+    """
+    Directory of an account's cookies and browser profile
+    """
+    return accounts_path / region / (re.sub(r"[^\w.@+-]", "_", username) or "default")
+
+
+@dataclass
+class Lease:
+    """
+    An account and its state in an `AccountPool`
+    """
+    account: Account
+    directory: Path
+    held: bool = False
+    released_at: float = 0.
+    cooling_until: float = 0.
+
+    @property
+    def cookies_file(self) -> Path:
+        return self.directory / "cookies.json"
+
+    @property
+    def profile_dir(self) -> Path:
+        return self.directory / "profile"
+
+
+class AccountPool:
+    """
+    Accounts of one site, each leased to one browser session at a time,
+    since a second reader session on an account gets ERROR998.
+    A lease goes to the account idle the longest, so the load is spread over them,
+    and an account that got ERROR998 anyway is not leased again for `cooldown` seconds.
+    Leasing blocks until an account is available.
+    """
+
+    def __init__(self, accounts: list[Account], region: str, cooldown: float = 600):
+        if not accounts:
+            raise ValueError(f"No account for region {region}")
+        self.region = region
+        self.cooldown = cooldown
+        self.leases = [Lease(account, namespace(region, account.username))
+                       for account in accounts]
+        self.changed = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self.leases)
+
+    @classmethod
+    def from_config(cls, cfg: Config, username: str, password: str,
+                    region: str) -> "AccountPool":
+        """
+        `username` and `password` first, then the accounts in the config for `region`
+        """
+        accounts = [a for a in cfg.accounts if a.region in (None, region)]
+        main = bool(username or password or not accounts)
+        if main:
+            accounts = [Account(username=username, password=password)] + [
+                a for a in accounts if a.username != username]
+        pool = cls(accounts, region, cfg.error998_cooldown)
+        first = pool.leases[0]
+        if main and not first.cookies_file.exists() and cookies_path.exists():
+            # seed from the single-session cookies to skip a fresh login
+            first.directory.mkdir(parents=True, exist_ok=True)
+            copyfile(cookies_path, first.cookies_file)
+        return pool
+
+    def lease(self) -> Lease:
+        with self.changed:
+            while True:
+                now = time.monotonic()
+                free = [lease for lease in self.leases if not lease.held]
+                ready = [lease for lease in free if lease.cooling_until <= now]
+                if ready:
+                    lease = min(ready, key=lambda lease: lease.released_at)
+                    lease.held = True
+                    lease.directory.mkdir(parents=True, exist_ok=True)
+                    return lease
+                timeout = None
+                if free:
+                    timeout = min(lease.cooling_until for lease in free) - now
+                    logging.info("Every free %s account is cooling down, waiting %.0fs",
+                                 self.region, timeout)
+                self.changed.wait(timeout)
+
+    def release(self, lease: Lease):
+        with self.changed:
+            lease.held = False
+            lease.released_at = time.monotonic()
+            self.changed.notify()
+
+    def cool_down(self, lease: Lease):
+        """
+        Do not lease the account again for a while, after it got ERROR998
+        """
+        with self.changed:
+            lease.cooling_until = time.monotonic() + self.cooldown
+        logging.warning("Resting account %s for %.0fs", lease.account.username,
+                        self.cooldown)
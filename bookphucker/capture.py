@@ -0,0 +1,460 @@
+import time
+import logging
+from base64 import b64encode
+from dataclasses import dataclass
+from functools import cache
+from typing import Literal
+from selenium import webdriver
+from selenium.common.exceptions import JavascriptException, TimeoutException
+from .metrics import BookMetrics
+from .tuning import RenderTuner
+
+# how the canvas leaves the browser: PNG data url, lossless WebP blob,
+# or raw pixels read over the DevTools protocol and encoded off the WebDriver thread
+Transport = Literal["png", "webp", "rgba"]
+
+
+@dataclass
+class Frame:
+    """
+    A captured canvas, nothing is sent for frames the browser found blank
+    or unchanged since the last one it sent
+    """
+    chunks: list[str]  # base64 of the image, raw RGBA pixels for "rgba"
+    format: Transport
+    width: int
+    height: int
+    skipped: Literal["blank", "unchanged"] | None = None
+
+    @property
+    def suffix(self) -> str:
+        return "webp" if self.format == "webp" else "png"
+
+    @property
+    def size(self) -> int:
+        return sum(len(chunk) * 3 // 4 - chunk[-2:].count("=") for chunk in self.chunks)
+
+
+@dataclass(frozen=True)
+class Navigation:
+    """
+    How a viewer reports and changes its zero-based position, see `Region.navigation`:
+    the source of two JS functions run in the page, where `bp.menu` is the menu
+    of the viewer. `position()` is -1 while unknown, `move_to(target)` starts moving.
+    """
+    position: str
+    move_to: str
+
+
+# Resolves `NFBR.a6G.Initializer.*.menu` once per document and keeps it on
+# `window.__bp`, along with hooks that wake up waiters whenever the DOM changes
+# or a canvas is drawn on. The scripts below run after it, see `viewer_script`
+VIEWER_JS = """
+const bp = window.__bp = window.__bp || {};
+if (!bp.menu) {
+    for (const k in NFBR.a6G.Initializer) {
+        if (NFBR.a6G.Initializer[k]['menu'] !== undefined) {
+            bp.menu = NFBR.a6G.Initializer[k].menu;
+            break;
+        }
+    }
+}
+if (!bp.waiters) {
+    bp.waiters = new Set();
+    bp.draws = 0;
+    bp.notify = () => bp.waiters.forEach(w => w());
+    new MutationObserver(bp.notify).observe(document.documentElement, {
+        subtree: true, childList: true, characterData: true,
+        attributes: true, attributeFilter: ['style', 'class']});
+    // what part of a canvas holds drawn pixels, and how many source pixels went into
+    // each of its pixels, so captures can be cropped and sized to the page images
+    const track = (canvas, x, y, w, h, scale) => {
+        let info = canvas.__bp;
+        if (!info || info.width !== canvas.width || info.height !== canvas.height) {
+            info = canvas.__bp = {
+                width: canvas.width, height: canvas.height, rect: null, scale: 0};
+        }
+        const x0 = Math.max(0, Math.min(x, x + w));
+        const y0 = Math.max(0, Math.min(y, y + h));
+        const x1 = Math.min(canvas.width, Math.max(x, x + w));
+        const y1 = Math.min(canvas.height, Math.max(y, y + h));
+        if (x1 <= x0 || y1 <= y0) {
+            return;
+        }
+        const r = info.rect;
+        info.rect = r ? {x0: Math.min(r.x0, x0), y0: Math.min(r.y0, y0),
+                         x1: Math.max(r.x1, x1), y1: Math.max(r.y1, y1)}
+                      : {x0, y0, x1, y1};
+        if (scale && (x1 - x0) * (y1 - y0) * 16 >= canvas.width * canvas.height) {
+            info.scale = scale;  // ignore icons and other small overlays
+        }
+    };
+    const proto = CanvasRenderingContext2D.prototype;
+    const drawImage = bp.drawImage = proto.drawImage;
+    proto.drawImage = function (src, ...a) {
+        const result = drawImage.call(this, src, ...a);
+        const width = src.naturalWidth || src.videoWidth || src.width;
+        const height = src.naturalHeight || src.videoHeight || src.height;
+        const [sx, sy, sw, sh, dx, dy, dw, dh] = a.length === 8 ? a
+            : [0, 0, width, height, a[0], a[1], a[2] ?? width, a[3] ?? height];
+        const scale = ((src.__bp && src.__bp.scale) || 1) * Math.max(sw / dw, sh / dh);
+        track(this.canvas, dx, dy, dw, dh, isFinite(scale) ? scale : 0);
+        bp.draws++;
+        bp.notify();
+        return result;
+    };
+    const putImageData = proto.putImageData;
+    proto.putImageData = function (data, dx, dy) {
+        const result = putImageData.apply(this, arguments);
+        track(this.canvas, dx, dy, data.width, data.height, 1);
+        bp.draws++;
+        bp.notify();
+        return result;
+    };
+    // painting over the whole canvas starts it over
+    for (const name of ['clearRect', 'fillRect']) {
+        const original = proto[name];
+        proto[name] = function (x, y, w, h) {
+            const info = this.canvas.__bp;
+            if (info && x <= 0 && y <= 0
+                    && x + w >= this.canvas.width && y + h >= this.canvas.height) {
+                info.rect = null;
+            }
+            return original.apply(this, arguments);
+        };
+    }
+    // resolves on the next frame, or shortly after in throttled background tabs
+    bp.frame = () => new Promise(resolve => {
+        requestAnimationFrame(() => resolve());
+        setTimeout(resolve, 50);
+    });
+    // resolves once `predicate` holds, re-checked on every DOM change or canvas draw
+    bp.until = (predicate, timeout) => new Promise((resolve, reject) => {
+        if (predicate()) {
+            resolve();
+            return;
+        }
+        const check = () => {
+            if (predicate()) {
+                cleanup();
+                resolve();
+            }
+        };
+        // safety net for changes neither hook sees, e.g. CSS transitions ending
+        const interval = setInterval(check, bp.interval || 250);
+        const timer = setTimeout(() => {
+            cleanup();
+            const error = new Error('timeout');
+            error.name = 'TimeoutError';  // told apart from the scripts failing
+            reject(error);
+        }, timeout * 1000);
+        const cleanup = () => {
+            bp.waiters.delete(check);
+            clearInterval(interval);
+            clearTimeout(timer);
+        };
+        bp.waiters.add(check);
+    });
+}
+bp.loading = () => Array.from(document.getElementsByClassName('loading')).some(
+    e => (e.offsetWidth || e.offsetHeight || e.getClientRects().length)
+        && getComputedStyle(e).visibility !== 'hidden');
+"""
+
+CAPTURE_JS = """
+const [target, timeout, redraw, interval, transport, precheck, force, done] = arguments;
+bp.interval = interval * 1000;
+bp.blob = null;
+const canvas = () => document.querySelector('.currentScreen canvas');
+const ready = () => bp.position() === target && !bp.loading() && canvas();
+// the drawn part of the canvas, when cropping was turned on by `fit_native_resolution`
+const exported = c => {
+    const info = c.__bp;
+    if (!bp.crop || !info || !info.rect
+            || info.width !== c.width || info.height !== c.height) {
+        return c;
+    }
+    const x0 = Math.floor(info.rect.x0), y0 = Math.floor(info.rect.y0);
+    const w = Math.ceil(info.rect.x1) - x0, h = Math.ceil(info.rect.y1) - y0;
+    if (w === c.width && h === c.height) {
+        return c;
+    }
+    const out = document.createElement('canvas');
+    out.width = w;
+    out.height = h;
+    bp.drawImage.call(out.getContext('2d'), c, x0, y0, w, h, 0, 0, w, h);
+    return out;
+};
+// a hash of a small copy, whether nothing at all was drawn on it,
+// and whether it is all one shade, like `dhash` finds uniform pages
+const fingerprint = c => {
+    const sample = bp.sample = bp.sample || document.createElement('canvas');
+    sample.width = sample.height = 128;
+    const ctx = sample.getContext('2d', {willReadFrequently: true});
+    ctx.imageSmoothingQuality = 'high';
+    bp.drawImage.call(ctx, c, 0, 0, c.width, c.height, 0, 0, 128, 128);
+    const px = ctx.getImageData(0, 0, 128, 128).data;
+    let hash = 0x811c9dc5, blank = true, low = 255, high = 0;
+    for (let i = 0; i < px.length; i += 4) {
+        for (let j = i; j < i + 4; j++) {
+            hash = Math.imul(hash ^ px[j], 16777619);
+        }
+        blank = blank && px[i + 3] === 0;
+        const luma = (px[i] * 299 + px[i + 1] * 587 + px[i + 2] * 114) / 1000;
+        low = Math.min(low, luma);
+        high = Math.max(high, luma);
+    }
+    return {hash: `${c.width}x${c.height}:${(hash >>> 0).toString(16)}`, blank,
+            uniform: high - low < 8};
+};
+const base64 = url => url.slice(url.indexOf(',') + 1);
+const read = blob => new Promise((resolve, reject) => {
+    const reader = new FileReader();
+    reader.onload = () => resolve(base64(reader.result));
+    reader.onerror = () => reject(reader.error);
+    reader.readAsDataURL(blob);
+});
+const encode = async c => {
+    if (transport === 'webp') {
+        // Chrome encodes WebP losslessly at quality 1,
+        // other browsers may fall back to PNG
+        const blob = await new Promise(resolve => c.toBlob(resolve, 'image/webp', 1));
+        const format = blob.type === 'image/webp' ? 'webp' : 'png';
+        return {format, data: await read(blob)};
+    }
+    if (transport === 'rgba') {
+        // left for `read_blob` to fetch over the DevTools protocol
+        let ctx = c.getContext('2d');
+        if (!ctx) {
+            const copy = document.createElement('canvas');
+            copy.width = c.width;
+            copy.height = c.height;
+            ctx = copy.getContext('2d');
+            bp.drawImage.call(ctx, c, 0, 0);
+        }
+        bp.blob = new Blob([ctx.getImageData(0, 0, c.width, c.height).data]);
+        return {format: 'rgba', size: bp.blob.size};
+    }
+    return {format: 'png', data: base64(c.toDataURL('image/png'))};
+};
+const deadline = Date.now() + timeout * 1000;
+const remaining = () => Math.max(0, deadline - Date.now()) / 1000;
+(async () => {
+    const t0 = performance.now();
+    const draws = bp.draws;
+    const started = bp.target === target;  // by MOVE_JS
+    bp.target = undefined;
+    if (bp.position() !== target) {
+        if (!started) {
+            bp.moveTo(target);
+        }
+    } else if (redraw) {
+        // retrying a page we are already on, give the viewer a chance to draw again
+        await bp.until(() => bp.draws !== draws, redraw).catch(() => {});
+    }
+    const t1 = performance.now();
+    await bp.until(() => bp.position() === target, remaining());
+    const t2 = performance.now();
+    do {
+        await bp.until(ready, remaining());
+        await bp.frame();  // let the renderer flush what it has just drawn
+    } while (!ready());
+    const t3 = performance.now();
+    const c = exported(canvas());
+    const seen = precheck ? fingerprint(c) : null;
+    const t4 = performance.now();
+    const timings = {navigate: t1 - t0, wait_spread: t2 - t1, wait_loading: t3 - t2,
+                     fingerprint: t4 - t3};
+    const frame = {format: transport, width: c.width, height: c.height, timings};
+    // retrying would only send the same pixels again, but uniform pages
+    // legitimately follow each other, e.g. two white pages
+    if (seen && !force && (seen.blank || seen.hash === bp.sent && !seen.uniform)) {
+        return {...frame, skipped: seen.blank ? 'blank' : 'unchanged'};
+    }
+    bp.sent = seen && seen.hash;
+    const encoded = await encode(c);
+    timings.export = performance.now() - t4;
+    return {...frame, ...encoded};
+})().then(done, e => done(e && e.name === 'TimeoutError'
+    ? {error: 'timeout', position: bp.position()}
+    : {error: String(e && e.stack || e)}));
+"""
+
+# Starts moving the viewer to `target` without waiting for it,
+# `capture` then waits for the move under way instead of starting it again
+MOVE_JS = """
+const [target] = arguments;
+bp.target = bp.position() !== target ? target : undefined;
+if (bp.target !== undefined) {
+    bp.moveTo(target);
+}
+"""
+
+# Draws the page at `target` once more with the hooks in place (by moving away
+# and back), then reports how many page image pixels went into each canvas pixel
+PROBE_JS = """
+const [target, other, timeout, done] = arguments;
+const canvas = () => document.querySelector('.currentScreen canvas');
+const at = t => () => bp.position() === t && !bp.loading() && canvas();
+(async () => {
+    for (const t of [other, target]) {
+        bp.moveTo(t);
+        await bp.until(at(t), timeout);
+    }
+    await bp.frame();
+    const info = canvas().__bp;
+    return {scale: info ? info.scale : 0, dpr: devicePixelRatio, draws: bp.draws,
+            width: innerWidth, height: innerHeight};
+})().then(done, e => done({error: String(e)}));
+"""
+
+# Waits for the viewer to draw again after the device metrics changed
+REDRAW_JS = """
+const [draws, timeout, done] = arguments;
+bp.until(() => bp.draws !== draws && !bp.loading(), timeout)
+    .then(() => bp.frame()).then(() => done(true), () => done(false));
+"""
+
+
+@cache
+def viewer_script(script: str, navigation: Navigation) -> str:
+    """
+    `script` after VIEWER_JS and the position functions of `navigation`
+    """
+    return (f"{VIEWER_JS}bp.position = {navigation.position};\n"
+            f"bp.moveTo = {navigation.move_to};\n{script}")
+
+
+def fit_native_resolution(driver: webdriver.Chrome, total: int,
+                          navigation: Navigation, timeout: float = 30,
+                          tolerance: float = 0.05, max_scale: float = 4):
+    """
+    Set the device scale factor so the canvas has as many pixels as the page images,
+    and crop captures to the drawn part of the canvas from then on.
+    The viewport keeps its size, `total` is the number of spreads/pages of the book.
+    """
+    if total < 2:
+        return
+    driver.set_script_timeout(timeout * 2 + 5)
+    for _ in range(3):  # the viewer may not scale its canvas exactly with the device
+        result = driver.execute_async_script(viewer_script(PROBE_JS, navigation),
+                                             0, 1, timeout)
+        if "error" in result:
+            logging.warning("Could not measure the page resolution: %s",
+                            result["error"])
+            return
+        driver.execute_script("window.__bp.crop = true;")
+        scale = result["scale"]
+        if not scale or abs(scale - 1) <= tolerance:
+            break
+        dpr = min(max_scale, max(0.5, result["dpr"] * scale))
+        logging.info("Pages are drawn at %.2fx their resolution, "
+                     "device scale factor %.2f -> %.2f", 1 / scale, result["dpr"], dpr)
+        driver.execute_cdp_cmd("Emulation.setDeviceMetricsOverride", {
+            "width": result["width"], "height": result["height"],
+            "deviceScaleFactor": dpr, "mobile": False})
+        driver.execute_async_script(viewer_script(REDRAW_JS, navigation),
+                                    result["draws"], timeout)
+        if dpr in (0.5, max_scale):
+            break
+
+
+def capture(driver: webdriver.Chrome, target: int, navigation: Navigation,
+            timeout: float = 30, redraw: float = 0, metrics: BookMetrics | None = None,
+            tuner: RenderTuner | None = None, transport: Transport = "png",
+            precheck: bool = False, force: bool = False) -> Frame:
+    """
+    Move the viewer to zero-based spread/page `target`, wait for it to be rendered
+    and return the current canvas, sent as `transport`, all in one round trip.
+    With `redraw`, waits up to that many seconds for the canvas to be drawn again
+    when the viewer is already at `target`, for retrying unloaded pages.
+    Time spent in each step is added to `metrics`.
+    With `tuner`, the redraw wait and polling interval follow the render latency
+    seen so far, and pages slower than usual are logged before waiting up to `timeout`.
+    With `precheck`, the browser hashes a small copy of the canvas first and sends
+    nothing when it is blank or the same as the last frame sent, unless `force`.
+    Uniform frames are sent again, consecutive pages may be the same shade.
+    """
+    interval = 0.25
+    soft_timeout = timeout
+    if tuner is not None:
+        redraw = tuner.redraw() if redraw else 0
+        interval = tuner.interval()
+        soft_timeout = min(timeout, tuner.timeout())
+    begin = time.perf_counter()
+    options = (transport, precheck, force)
+    result = run_capture(driver, target, navigation, soft_timeout, redraw, interval,
+                         *options)
+    if result.get("error") == "timeout" and soft_timeout < timeout:
+        logging.warning("Page %s is slow to render, waiting up to %ss",
+                        target + 1, timeout)
+        if metrics is not None:
+            metrics.count("slow_pages")
+        # only moves again if the viewer has not got there yet
+        result = run_capture(driver, target, navigation, timeout - soft_timeout, 0,
+                             interval, *options)
+    if result.get("error") == "timeout":
+        raise TimeoutException(
+            f"Viewer stuck at {result['position']} while moving to {target}")
+    if "error" in result:
+        # a bug of ours or a change of the viewer, not worth waiting for
+        raise JavascriptException(
+            f"Capture failed on page {target + 1}: {result['error']}")
+    timings = result["timings"]
+    chunks = [result["data"]] if "data" in result else []
+    if result["format"] == "rgba" and not result.get("skipped"):
+        begin_read = time.perf_counter()
+        chunks = read_blob(driver)
+        timings["read"] = (time.perf_counter() - begin_read) * 1000
+    elapsed = time.perf_counter() - begin
+    frame = Frame(chunks, result["format"], result["width"], result["height"],
+                  result.get("skipped"))
+    if tuner is not None:
+        tuner.observe((timings["wait_spread"] + timings["wait_loading"]) / 1000)
+    if metrics is not None:
+        for name, ms in timings.items():
+            metrics.add(name, ms / 1000)
+        # whatever the browser did not account for went into the round trip
+        metrics.add("transfer", max(0, elapsed - sum(timings.values()) / 1000))
+        if frame.skipped:
+            metrics.count("unsent_frames")
+        metrics.count("sent_bytes", frame.size)
+    return frame
+
+
+def run_capture(driver: webdriver.Chrome, target: int, navigation: Navigation,
+                timeout: float, redraw: float, interval: float,
+                transport: Transport = "png", precheck: bool = False,
+                force: bool = False) -> dict:
+    driver.set_script_timeout(timeout + redraw + 5)
+    return driver.execute_async_script(viewer_script(CAPTURE_JS, navigation), target,
+                                       timeout, redraw, interval, transport, precheck,
+                                       force)
+
+
+def read_blob(driver: webdriver.Chrome, chunk_size: int = 1 << 24) -> list[str]:
+    """
+    Base64 chunks of the pixels left in `window.__bp.blob` by an "rgba" capture,
+    read over the DevTools protocol rather than through a script result
+    """
+    group = "bookphucker"
+    blob = driver.execute_cdp_cmd("Runtime.evaluate", {
+        "expression": "window.__bp.blob", "objectGroup": group})["result"]
+    try:
+        handle = "blob:" + driver.execute_cdp_cmd(
+            "IO.resolveBlob", {"objectId": blob["objectId"]})["uuid"]
+        chunks = list[str]()
+        try:
+            while True:
+                chunk = driver.execute_cdp_cmd(
+                    "IO.read", {"handle": handle, "size": chunk_size})
+                data = chunk["data"]
+                # parts that happen to be valid UTF-8 are sent as text
+                chunks.append(data if chunk.get("base64Encoded")
+                              else b64encode(data.encode("utf-8")).decode("ascii"))
+                if chunk.get("eof"):
+                    return chunks
+        finally:
+            driver.execute_cdp_cmd("IO.close", {"handle": handle})
+    finally:
+        driver.execute_cdp_cmd("Runtime.releaseObjectGroup", {"objectGroup": group})
@@ -0,0 +1,197 @@
+import time
+import logging
+import sqlite3
+import threading
+import ujson as json
+from pathlib import Path
+from typing import Iterable, Literal
+from pydantic import BaseModel
+from .commonvars import books_path, catalog_path
+
+BookState = Literal["partial", "complete"]
+
+# key prefix of books adopted from before their UUID was recorded in `meta.json`
+LEGACY = "legacy:"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    book_uuid TEXT PRIMARY KEY,
+    product_id TEXT,
+    region TEXT NOT NULL,
+    title TEXT NOT NULL,
+    authors TEXT NOT NULL,  -- JSON list
+    pages INTEGER,  -- spreads or pages in the viewer, once opened
+    saved INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'partial',
+    path TEXT NOT NULL UNIQUE,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS books_product_id ON books (product_id);
+"""
+
+
+class CatalogEntry(BaseModel):
+    book_uuid: str
+    product_id: str | None = None
+    region: str
+    title: str
+    authors: list[str]
+    pages: int | None = None
+    saved: int = 0
+    state: BookState = "partial"
+    path: str
+    updated_at: float
+
+
+class Catalog:
+    """
+    Every book downloaded so far keyed by UUID, with where it is saved and whether
+    all of its pages are. Output directories are named after titles, books sharing
+    a title get their UUID appended instead of writing into each other.
+    Opened once per process and safe to use from any thread.
+    """
+    _catalogs = dict[Path, "Catalog"]()
+    _lock = threading.Lock()
+
+    def __init__(self, path: Path = catalog_path):
+        self.path = path
+        self.lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        new = not path.exists()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        if new:
+            self.adopt(path.parent)
+
+    @classmethod
+    def open(cls, path: Path = catalog_path) -> "Catalog":
+        with cls._lock:
+            catalog = cls._catalogs.get(path)
+            if catalog is None:
+                catalog = cls._catalogs[path] = cls(path)
+            return catalog
+
+    def get(self, book_uuid: str) -> CatalogEntry | None:
+        with self.lock:
+            row = self.db.execute("SELECT * FROM books WHERE book_uuid = ?",
+                                  (book_uuid,)).fetchone()
+        return None if row is None else entry(row)
+
+    def completed(self, book_uuids: Iterable[str]) -> set[str]:
+        """
+        Those of `book_uuids` with every page saved, and their directory still there
+        """
+        book_uuids = list(book_uuids)
+        done = set[str]()
+        with self.lock:
+            for i in range(0, len(book_uuids), 500):  # under SQLite's variable limit
+                chunk = book_uuids[i:i + 500]
+                done.update(row[0] for row in self.db.execute(
+                    f"SELECT book_uuid, path FROM books WHERE state = 'complete'"
+                    f" AND book_uuid IN ({','.join('?' * len(chunk))})", chunk)
+                    if Path(row[1]).is_dir())
+        return done
+
+    def add(self, book_uuid: str, region: str, title: str, authors: list[str],
+            root: Path = books_path, product_id: str | None = None) -> Path:
+        """
+        Record a book being opened and write its `meta.json`,
+        returns its output directory
+        """
+        with self.lock:
+            row = self.db.execute("SELECT path FROM books WHERE book_uuid = ?",
+                                  (book_uuid,)).fetchone()
+            save_dir = Path(row[0]) if row else self.free_dir(
+                book_uuid, root, title, authors)
+            self.db.execute(
+                "INSERT INTO books"
+                " (book_uuid, product_id, region, title, authors, path, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (book_uuid) DO UPDATE SET"
+                " product_id = coalesce(excluded.product_id, product_id),"
+                " region = excluded.region,"
+                " title = excluded.title, authors = excluded.authors,"
+                " updated_at = excluded.updated_at",
+                (book_uuid, product_id, region, title,
+                 json.dumps(authors, ensure_ascii=False), str(save_dir), time.time()))
+            self.db.commit()
+        save_dir.mkdir(exist_ok=True, parents=True)
+        (save_dir / "meta.json").write_text(json.dumps(
+            {"title": title, "authors": authors, "uuid": book_uuid, "region": region},
+            ensure_ascii=False, indent=2), encoding="utf-8")
+        return save_dir
+
+    def free_dir(self, book_uuid: str, root: Path, title: str,
+                 authors: list[str]) -> Path:
+        """
+        `root/title`, unless another book has it already
+        """
+        save_dir = root / title
+        row = self.db.execute("SELECT book_uuid, authors FROM books WHERE path = ?",
+                              (str(save_dir),)).fetchone()
+        taken = row is not None
+        if taken and row[0].startswith(LEGACY) and json.loads(row[1]) == authors:
+            # downloaded before UUIDs were recorded, by the same authors: this book
+            self.db.execute("DELETE FROM books WHERE book_uuid = ?", (row[0],))
+            taken = False
+        meta_path = save_dir / "meta.json"
+        if not taken and meta_path.exists():
+            try:
+                taken = json.loads(meta_path.read_text(encoding="utf-8")).get(
+                    "uuid", book_uuid) != book_uuid
+            except ValueError:
+                pass
+        if taken:
+            save_dir = root / f"{title} [{book_uuid}]"
+            logging.info("Another book is titled %s, saving to %s", title, save_dir)
+        return save_dir
+
+    def update(self, book_uuid: str, pages: int | None = None,
+               saved: int | None = None):
+        """
+        Record how many spreads or pages a book has and how many are saved,
+        it is complete once they are all saved
+        """
+        with self.lock:
+            self.db.execute(
+                "UPDATE books SET pages = coalesce(?, pages),"
+                " saved = coalesce(?, saved), updated_at = ? WHERE book_uuid = ?",
+                (pages, saved, time.time(), book_uuid))
+            self.db.execute(
+                "UPDATE books SET state = CASE"
+                " WHEN pages IS NOT NULL AND saved >= pages THEN 'complete'"
+                " ELSE 'partial' END WHERE book_uuid = ?",
+                (book_uuid,))
+            self.db.commit()
+
+    def adopt(self, root: Path):
+        """
+        Record books downloaded before the catalog existed, as partial
+        since their number of pages is not known. Books from before UUIDs were
+        recorded are keyed by directory, until `add` finds them by title and authors
+        """
+        rows = list[tuple]()
+        for meta_path in root.glob("*/meta.json"):
+            try:
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            except ValueError:
+                continue
+            book_uuid = meta.get("uuid") or LEGACY + meta_path.parent.name
+            rows.append((book_uuid, meta.get("region", ""),
+                         meta.get("title", meta_path.parent.name),
+                         json.dumps(meta.get("authors", []), ensure_ascii=False),
+                         str(meta_path.parent), meta_path.stat().st_mtime))
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO books"
+                " (book_uuid, region, title, authors, path, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+        if rows:
+            logging.info("Adopted %s books into the catalog", len(rows))
+
+
+def entry(row: sqlite3.Row) -> CatalogEntry:
+    return CatalogEntry(**{**dict(row), "authors": json.loads(row["authors"])})
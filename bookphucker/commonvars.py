@@ -2,5 +2,8 @@ from pathlib import Path
 from platformdirs import user_cache_dir
 
 config_path = Path("config.json")
+books_path = Path("babies")
+ocr_db_path = books_path / "ocr.sqlite3"
+catalog_path = books_path / "catalog.sqlite3"
 cache_path = Path(user_cache_dir("bookphucker", ensure_exists=True))
 cookies_path = cache_path / "cookies.json"
@@ -1,15 +1,26 @@
 from __future__ import annotations
-import undetected_chromedriver as uc
+import shutil
 import logging
+import subprocess
+import ujson as json
+from pathlib import Path
+from contextlib import suppress
 from typing import Literal
 from pydantic import BaseModel, ConfigDict
 from semantic_version import Version
-from webdriver_manager.chrome import ChromeDriverManager
-from webdriver_manager.core.os_manager import ChromeType
-from selenium.webdriver.chrome.service import Service
+from .commonvars import cache_path
 
+driver_cache_path = cache_path / "chromedriver.json"
+
+
+CURRENT_VERSION = Version("0.2.5")
+
+
+class Account(BaseModel):
+    username: str
+    password: str
+    region: Literal["jp", "tw"] | None = None  # site the account is for, both if None
 
-CURRENT_VERSION = Version("0.2.0")
 
 class Config(BaseModel):
     model_config = ConfigDict(extra="allow", validate_assignment=True)
@@ -19,26 +30,87 @@ class Config(BaseModel):
     username: str | None = None
     password: str | None = None
     manual_login: bool = False
+    # more accounts to run sessions side by side, see `AccountPool`
+    accounts: list[Account] = []
+    error998_cooldown: float = 600  # seconds an account is left alone after ERROR998
     viewer_size: tuple[int, int] = (1440, 1440)
+    native_resolution: bool = False  # match the canvas to the pages and crop borders
+    tabs: int = 1  # viewers sharing the pages of a book, fewer if the site refuses
+    transport: Literal["png", "webp", "rgba"] = "png"  # how pages leave the browser
+    precheck: bool = True  # do not send frames the browser finds blank or unchanged
     user_agent: str | None = None
     logging_level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "INFO"
+    # metrics for the node exporter textfile collector
+    prometheus_textfile: str | None = None
 
-    def get_webdriver(self):
+    def get_webdriver(self, profile_dir: Path | None = None):
+        """
+        `profile_dir` gives the browser its own user data directory,
+        so that concurrent instances do not share a cookie jar
+        """
+        # deferred, importing these takes a while
+        import undetected_chromedriver as uc
+        from selenium.webdriver.chrome.service import Service
         ua = self.user_agent or "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
         options = uc.ChromeOptions()
         options.set_capability("unhandledPromptBehavior", "accept")
         options.add_argument("--high-dpi-support=1")
         options.add_argument(f"--user-agent={ua}")
-        options.add_argument(f"--window-size={self.viewer_size[0]},{self.viewer_size[1]}")
-        chrome_type = ChromeType.CHROMIUM if self.browser == "chromium" else ChromeType.GOOGLE
-        # Install matching ChromeDriver and create a Service
-        service = Service(ChromeDriverManager(chrome_type=chrome_type).install())
+        width, height = self.viewer_size
+        options.add_argument(f"--window-size={width},{height}")
+        # Reuse the ChromeDriver resolved for this browser binary,
+        # or install a matching one
+        service = Service(self.resolve_chromedriver())
         # Handle headless mode via options
         if self.headless:
             # use new headless flag for modern Chrome
             options.add_argument("--headless=new")
         # Initialize undetected_chromedriver with correct service
-        driver = uc.Chrome(options=options, service=service)
+        driver = uc.Chrome(options=options, service=service,
+                           user_data_dir=str(profile_dir) if profile_dir else None)
+        return driver
+
+    def find_browser(self) -> Path | None:
+        if self.browser == "chromium":
+            for name in ("chromium", "chromium-browser"):
+                if found := shutil.which(name):
+                    return Path(found).resolve()
+            return None
+        import undetected_chromedriver as uc
+        found = uc.find_chrome_executable()
+        return Path(found).resolve() if found else None
+
+    def resolve_chromedriver(self) -> str:
+        """
+        ChromeDriver path matching the installed browser,
+        cached until the browser binary changes
+        """
+        binary = self.find_browser()
+        stat = binary.stat() if binary else None
+        key = {"binary": str(binary), "mtime": stat.st_mtime_ns if stat else None,
+               "size": stat.st_size if stat else None}
+        cache = dict[str, dict]()
+        if driver_cache_path.exists():
+            with suppress(ValueError):
+                cache = json.loads(driver_cache_path.read_text(encoding="utf-8"))
+        entry = cache.get(self.browser)
+        if entry and entry["key"] == key and Path(entry["driver"]).exists():
+            logging.debug("Using cached ChromeDriver %s for browser %s",
+                          entry["driver"], entry["version"])
+            return entry["driver"]
+
+        from webdriver_manager.chrome import ChromeDriverManager
+        from webdriver_manager.core.os_manager import ChromeType
+        chrome_type = (ChromeType.CHROMIUM if self.browser == "chromium"
+                       else ChromeType.GOOGLE)
+        driver = ChromeDriverManager(chrome_type=chrome_type).install()
+        version = ''
+        if binary:
+            result = subprocess.run([str(binary), "--version"],
+                                    capture_output=True, text=True)
+            version = result.stdout.strip()
+        cache[self.browser] = {"key": key, "driver": driver, "version": version}
+        driver_cache_path.write_text(json.dumps(cache, indent=2), encoding="utf-8")
         return driver
 
     def config_logging(self):
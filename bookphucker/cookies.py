@@ -0,0 +1,133 @@
+import time
+import logging
+import threading
+import ujson as json
+import requests
+from pathlib import Path
+from typing import Any
+from selenium import webdriver
+from .commonvars import cookies_path
+from .utils import write_atomic
+
+# cookie that carries the logged in session on both sites
+SESSION_COOKIE = "bwmember"
+
+
+class CookieStore:
+    """
+    Browser cookies per site domain, loaded once per process
+    and written back atomically on `flush`.
+    Cookies are moved in and out of the browser over CDP, so no navigation is needed.
+    """
+    _stores = dict[Path, "CookieStore"]()
+    _lock = threading.Lock()
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.sites = dict[str, list[dict[str, Any]]]()
+        self.validated = dict[str, float]()  # domain -> time of the last good check
+        self.dirty = False
+        self.sessions = dict[str, requests.Session]()
+        if path.exists():
+            data = json.loads(path.read_text(encoding="utf-8"))
+            if "sites" in data:
+                self.sites = data["sites"]
+                self.validated = data.get("validated", {})
+            else:  # cookies.json from before, keyed by netloc
+                self.sites = data
+
+    @classmethod
+    def open(cls, path: Path = cookies_path) -> "CookieStore":
+        with cls._lock:
+            store = cls._stores.get(path)
+            if store is None:
+                store = cls._stores[path] = cls(path)
+            return store
+
+    def cookies(self, domain: str) -> list[dict[str, Any]]:
+        return [c for site, cookies in self.sites.items()
+                if site == domain or site.endswith("." + domain) for c in cookies]
+
+    def expires_at(self, domain: str) -> float:
+        expiry = [c["expiry"] for c in self.cookies(domain)
+                  if c["name"] == SESSION_COOKIE and "expiry" in c]
+        return min(expiry, default=0)
+
+    def fresh(self, domain: str, max_age: float = 3600) -> bool:
+        """
+        Whether the session was validated within `max_age` seconds
+        and its cookie has not expired since
+        """
+        now = time.time()
+        return (now - self.validated.get(domain, 0) < max_age
+                and self.expires_at(domain) > now)
+
+    def mark_validated(self, domain: str):
+        self.validated[domain] = time.time()
+        self.dirty = True
+
+    def invalidate(self, domain: str):
+        self.validated.pop(domain, None)
+        self.sessions.pop(domain, None)
+        self.dirty = True
+
+    def restore(self, driver: webdriver.Chrome, domain: str) -> bool:
+        """
+        Put the stored cookies of `domain` into the browser
+        """
+        cookies = self.cookies(domain)
+        if not any(c["name"] == SESSION_COOKIE for c in cookies):
+            return False
+        driver.execute_cdp_cmd("Network.setCookies", {"cookies": [
+            {k: v for k, v in {
+                "name": c["name"], "value": c["value"], "domain": c["domain"],
+                "path": c.get("path", "/"), "secure": c.get("secure", False),
+                "httpOnly": c.get("httpOnly", False), "sameSite": c.get("sameSite"),
+                "expires": c.get("expiry"),
+            }.items() if v is not None} for c in cookies]})
+        return True
+
+    def capture(self, driver: webdriver.Chrome, domain: str):
+        """
+        Take every cookie of `domain` and its subdomains from the browser
+        """
+        sites = dict[str, list[dict[str, Any]]]()
+        for c in driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]:
+            site = c["domain"].lstrip(".")
+            if site != domain and not site.endswith("." + domain):
+                continue
+            cookie = {k: c[k] for k in ("name", "value", "domain", "path",
+                                        "secure", "httpOnly") if k in c}
+            if c.get("sameSite"):
+                cookie["sameSite"] = c["sameSite"]
+            if not c.get("session") and c.get("expires", -1) > 0:
+                cookie["expiry"] = int(c["expires"])
+            sites.setdefault(site, []).append(cookie)
+        for site in [s for s in self.sites if s == domain or s.endswith("." + domain)]:
+            del self.sites[site]
+        self.sites.update(sites)
+        self.sessions.pop(domain, None)
+        self.dirty = True
+
+    def session(self, domain: str, user_agent: str | None = None) -> requests.Session:
+        """
+        A pooled HTTP session carrying the cookies of `domain`
+        """
+        session = self.sessions.get(domain)
+        if session is None:
+            session = self.sessions[domain] = requests.Session()
+            for c in self.cookies(domain):
+                session.cookies.set(c["name"], c["value"],
+                                    domain=c["domain"], path=c.get("path", "/"))
+        if user_agent:
+            session.headers["User-Agent"] = user_agent
+        return session
+
+    def flush(self):
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = {"sites": self.sites, "validated": self.validated}
+        write_atomic(self.path, json.dumps(data, indent=2).encode("utf-8"))
+        self.dirty = False
+        logging.debug("Saved cookies to %s", self.path)
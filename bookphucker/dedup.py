@@ -0,0 +1,50 @@
+from collections import deque
+
+
+class PageIndex:
+    """
+    Content and perceptual hashes of the pages of a book.
+    A stale buffer repeats a page the viewer showed moments ago, so near duplicates
+    are only looked for among the last `recent` pages added. Further back only
+    identical content counts, sparse pages such as chapter titles are too alike
+    to be told apart by their perceptual hash alone.
+    """
+
+    def __init__(self, max_distance: int = 4, recent: int = 8):
+        self.max_distance = max_distance
+        self.digests = dict[str, int]()
+        self.pages = dict[int, tuple[str, int]]()
+        self.recent = deque[int](maxlen=recent)
+
+    def add(self, page: int, digest: str, phash: int | None):
+        self.remove(page)
+        if phash is None:
+            return
+        self.pages[page] = (digest, phash)
+        self.digests[digest] = page
+        self.recent.append(page)
+
+    def remove(self, page: int):
+        if page not in self.pages:
+            return
+        digest, _ = self.pages.pop(page)
+        if self.digests.get(digest) == page:
+            del self.digests[digest]
+        if page in self.recent:
+            self.recent.remove(page)
+
+    def find(self, page: int, digest: str, phash: int | None) -> int | None:
+        """
+        Return another page this capture repeats, if any.
+        Uniform pages (no `phash`) are legitimately repeated, e.g. blank pages.
+        """
+        if phash is None:
+            return None
+        other = self.digests.get(digest)
+        if other is not None and other != page:
+            return other
+        for other in reversed(self.recent):
+            distance = (phash ^ self.pages[other][1]).bit_count()
+            if other != page and distance <= self.max_distance:
+                return other
+        return None
@@ -0,0 +1,55 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+from urllib.parse import urlparse
+from rich.progress import Progress
+from selenium import webdriver
+from bookphucker import Config
+from .capture import Navigation, fit_native_resolution
+from .catalog import Catalog
+from .commonvars import cookies_path
+from .metrics import book_metrics
+from .pipeline import capture_pages
+from .tabs import Tabs
+from .tuning import RenderTuner
+
+# (driver, cfg, book uuid, cookies file) -> (save directory, title, spreads/pages)
+OpenBook = Callable[[webdriver.Chrome, Config, str, Path], tuple[Path, str, int]]
+
+
+@dataclass(frozen=True)
+class Region:
+    """
+    What the capture engine needs from a site: how to open a book in the reader
+    and write its metadata, and how its viewer reports and changes position.
+    Navigation runs in the page, injected into the capture scripts.
+    """
+    name: str
+    domain: str
+    navigation: Navigation
+    open_book: OpenBook
+
+
+def download_book(region: Region, driver: webdriver.Chrome, cfg: Config, book_uuid: str,
+                  overwrite: bool, cookies_file: Path = cookies_path,
+                  progress: Progress | None = None, verify: bool = False):
+    with book_metrics(book_uuid, region.name, cfg.prometheus_textfile) as metrics:
+        with metrics.span("open"):
+            save_dir, title, total = region.open_book(driver, cfg, book_uuid,
+                                                      cookies_file)
+        metrics.title, metrics.save_dir = title, save_dir
+        catalog = Catalog.open()
+        catalog.update(book_uuid, pages=total)
+        if cfg.native_resolution:
+            with metrics.span("fit"):
+                fit_native_resolution(driver, total, region.navigation)
+        tuner = RenderTuner.load(urlparse(driver.current_url).hostname or region.domain)
+        try:
+            with Tabs(driver, region.navigation, cfg, metrics, tuner) as tabs:
+                saved = capture_pages(tabs.grab, range(1, total + 1), save_dir,
+                                      overwrite, verify=verify, description=title,
+                                      progress=progress, metrics=metrics,
+                                      plan=tabs.plan)
+        finally:
+            tuner.save()
+        catalog.update(book_uuid, saved=saved)
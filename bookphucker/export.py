@@ -0,0 +1,211 @@
+import os
+import argparse
+import hashlib
+import logging
+import ujson as json
+from datetime import datetime, timezone
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Literal
+from xml.sax.saxutils import escape
+from zipfile import ZipFile, BadZipFile, ZIP_STORED, ZIP_DEFLATED
+from .commonvars import books_path
+from .manifest import Manifest, PageEntry
+from .utils import file_mode
+
+Format = Literal["epub", "cbz"]
+Direction = Literal["rtl", "ltr"]
+
+LANGUAGES = {"jp": "ja", "tw": "zh-Hant"}
+MEDIA_TYPES = {".png": "image/png", ".webp": "image/webp", ".jpg": "image/jpeg"}
+XHTML = ('<html xmlns="http://www.w3.org/1999/xhtml"'
+         ' xmlns:epub="http://www.idpf.org/2007/ops">')
+
+
+def book_pages(book_dir: Path) -> list[PageEntry]:
+    manifest = Manifest.load(book_dir)
+    return [e for _, e in sorted(manifest.pages.items()) if not e.bad]
+
+
+def export_digest(meta: dict, pages: list[PageEntry], fmt: Format,
+                  direction: Direction) -> str:
+    """
+    Identifies the archive contents, stored as the zip comment
+    so unchanged books are not rebuilt
+    """
+    h = hashlib.sha1(json.dumps([meta, fmt, direction], sort_keys=True).encode())
+    for entry in pages:
+        h.update(f"{entry.page}:{entry.sha1}\n".encode())
+    return f"bookphucker:{h.hexdigest()}"
+
+
+def archive_digest(path: Path) -> str | None:
+    if not path.exists():
+        return None
+    try:
+        with ZipFile(path) as zf:
+            return zf.comment.decode(errors="replace")
+    except (OSError, BadZipFile):
+        return None
+
+
+def write_cbz(zf: ZipFile, book_dir: Path, meta: dict, pages: list[PageEntry],
+              direction: Direction):
+    info = (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<ComicInfo xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n'
+        f'  <Title>{escape(meta["title"])}</Title>\n'
+        f'  <Writer>{escape(", ".join(meta.get("authors", [])))}</Writer>\n'
+        f'  <PageCount>{len(pages)}</PageCount>\n'
+        f'  <Manga>{"YesAndRightToLeft" if direction == "rtl" else "No"}</Manga>\n'
+        '</ComicInfo>\n')
+    zf.writestr("ComicInfo.xml", info, compress_type=ZIP_DEFLATED)
+    width = len(str(len(pages)))
+    for i, entry in enumerate(pages, 1):
+        # images are already compressed, store them as is
+        zf.write(book_dir / entry.file, f"{i:0{width}d}{Path(entry.file).suffix}",
+                 compress_type=ZIP_STORED)
+
+
+def write_epub(zf: ZipFile, book_dir: Path, meta: dict, pages: list[PageEntry],
+               direction: Direction):
+    """
+    Fixed layout EPUB 3, one XHTML page per image
+    """
+    # mimetype must be the first entry and stored uncompressed
+    zf.writestr("mimetype", "application/epub+zip", compress_type=ZIP_STORED)
+    zf.writestr("META-INF/container.xml", (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<container version="1.0"'
+        ' xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+        '  <rootfiles>\n'
+        '    <rootfile full-path="OEBPS/content.opf"'
+        ' media-type="application/oebps-package+xml"/>\n'
+        '  </rootfiles>\n'
+        '</container>\n'), compress_type=ZIP_DEFLATED)
+
+    title = escape(meta["title"])
+    manifest_items = list[str]()
+    spine_items = list[str]()
+    width = len(str(len(pages)))
+    for i, entry in enumerate(pages, 1):
+        name = f"p{i:0{width}d}"
+        suffix = Path(entry.file).suffix
+        zf.write(book_dir / entry.file, f"OEBPS/images/{name}{suffix}",
+                 compress_type=ZIP_STORED)
+        zf.writestr(f"OEBPS/{name}.xhtml", (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<!DOCTYPE html>\n'
+            f'{XHTML}\n'
+            f'<head><title>{title}</title><meta name="viewport"'
+            f' content="width={entry.width}, height={entry.height}"/>'
+            '<style>body{margin:0}img{width:100%;height:100%;display:block}</style>'
+            '</head>\n'
+            f'<body><img src="images/{name}{suffix}" alt="{i}"/></body>\n'
+            '</html>\n'), compress_type=ZIP_DEFLATED)
+        properties = ' properties="cover-image"' if i == 1 else ''
+        manifest_items.append(
+            f'<item id="img-{name}" href="images/{name}{suffix}" '
+            f'media-type="{MEDIA_TYPES.get(suffix, "image/png")}"{properties}/>')
+        manifest_items.append(
+            f'<item id="{name}" href="{name}.xhtml"'
+            ' media-type="application/xhtml+xml"/>')
+        spine_items.append(f'<itemref idref="{name}"/>')
+
+    first = f"p{1:0{width}d}.xhtml" if pages else ""
+    zf.writestr("OEBPS/nav.xhtml", (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<!DOCTYPE html>\n'
+        f'{XHTML}\n'
+        f'<head><title>{title}</title></head>\n'
+        '<body><nav epub:type="toc"><ol>'
+        f'<li><a href="{first}">{title}</a></li>'
+        '</ol></nav></body>\n'
+        '</html>\n'), compress_type=ZIP_DEFLATED)
+
+    modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    creators = "".join(f"<dc:creator>{escape(a)}</dc:creator>"
+                       for a in meta.get("authors", []))
+    identifier = escape(meta.get("uuid")
+                        or hashlib.sha1(meta["title"].encode()).hexdigest())
+    language = LANGUAGES.get(meta.get("region", "jp"), "ja")
+    zf.writestr("OEBPS/content.opf", (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<package xmlns="http://www.idpf.org/2007/opf" version="3.0"'
+        ' unique-identifier="uid"'
+        ' prefix="rendition: http://www.idpf.org/vocab/rendition/#">\n'
+        '  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+        f'    <dc:identifier id="uid">{identifier}</dc:identifier>\n'
+        f'    <dc:title>{title}</dc:title>{creators}\n'
+        f'    <dc:language>{language}</dc:language>\n'
+        f'    <meta property="dcterms:modified">{modified}</meta>\n'
+        '    <meta property="rendition:layout">pre-paginated</meta>\n'
+        '    <meta property="rendition:spread">landscape</meta>\n'
+        '  </metadata>\n'
+        '  <manifest>\n'
+        '    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml"'
+        ' properties="nav"/>\n'
+        + "".join(f"    {item}\n" for item in manifest_items) +
+        '  </manifest>\n'
+        f'  <spine page-progression-direction="{direction}">\n'
+        + "".join(f"    {item}\n" for item in spine_items) +
+        '  </spine>\n'
+        '</package>\n'), compress_type=ZIP_DEFLATED)
+
+
+def export_book(book_dir: Path, fmt: Format, out_dir: Path | None = None,
+                direction: Direction = "rtl", force: bool = False) -> Path:
+    """
+    Stream the pages of `book_dir` into an EPUB or CBZ archive one at a time,
+    skipped when the archive already matches the page manifest
+    """
+    meta = json.loads((book_dir / "meta.json").read_text(encoding="utf-8"))
+    pages = book_pages(book_dir)
+    out_path = (out_dir or book_dir.parent) / f"{book_dir.name}.{fmt}"
+    digest = export_digest(meta, pages, fmt, direction)
+    if not force and archive_digest(out_path) == digest:
+        logging.info("%s is up to date", out_path)
+        return out_path
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with NamedTemporaryFile(dir=out_path.parent, prefix=f".{out_path.name}.",
+                            delete=False) as f:
+        try:
+            with ZipFile(f, "w") as zf:
+                if fmt == "epub":
+                    write_epub(zf, book_dir, meta, pages, direction)
+                else:
+                    write_cbz(zf, book_dir, meta, pages, direction)
+                zf.comment = digest.encode()
+            os.chmod(f.name, file_mode())
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, out_path)
+    logging.info("Exported %s pages to %s", len(pages), out_path)
+    return out_path
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="bookphucker export")
+    parser.add_argument("books",
+                        help="Book directories, defaults to every downloaded book",
+                        nargs='*', type=Path)
+    parser.add_argument("-f", "--format", help="Archive formats to build",
+                        nargs='+', default=["epub", "cbz"], choices=["epub", "cbz"])
+    parser.add_argument("-o", "--output",
+                        help="Output directory, defaults to next to the book",
+                        type=Path)
+    parser.add_argument("--ltr", help="Left to right page progression",
+                        action="store_true")
+    parser.add_argument("--force", help="Rebuild even if the pages have not changed",
+                        action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    books = args.books or sorted(p.parent for p in books_path.glob("*/meta.json"))
+    for book_dir in books:
+        for fmt in args.format:
+            export_book(book_dir, fmt, args.output,
+                        direction="ltr" if args.ltr else "rtl", force=args.force)
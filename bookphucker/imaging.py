@@ -0,0 +1,37 @@
+from typing import cast
+from PIL import Image
+
+
+def looks_unloaded(img: Image.Image, factor: int = 16, ratio: float = 0.005,
+                   luminance: bool = True) -> bool:
+    """
+    Cheap check on a `factor` times downsampled copy,
+    treats the page as still loading when less than `ratio` of it has been drawn.
+    Images without alpha are judged by their luminance, unless not `luminance`:
+    encoders such as WebP drop the alpha of a canvas drawn all over
+    """
+    if "A" not in img.getbands() and not luminance:
+        return False
+    band = img.getchannel("A") if "A" in img.getbands() else img.convert("L")
+    small = band.reduce(factor) if min(band.size) >= factor else band
+    histogram = small.histogram()
+    drawn = sum(histogram[1:])
+    return drawn <= ratio * small.width * small.height
+
+
+def dhash(img: Image.Image, size: int = 16) -> int | None:
+    """
+    Difference hash of `size` * `size` bits,
+    None for uniform pages which cannot be told apart from each other
+    """
+    small = img.convert("L").resize((size + 1, size), Image.Resampling.BOX)
+    low, high = cast(tuple[int, int], small.getextrema())  # single band
+    if high - low < 8:
+        return None
+    px = small.tobytes()
+    bits = 0
+    for y in range(size):
+        row = px[y * (size + 1):(y + 1) * (size + 1)]
+        for x in range(size):
+            bits = bits << 1 | (row[x] > row[x + 1])
+    return bits
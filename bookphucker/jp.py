@@ -1,10 +1,8 @@
-import ujson as json
 import bs4
-import io
+import requests
 import logging
-import time
 from typing import cast
-from rich.progress import track
+from rich.progress import Progress
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.common.exceptions import NoSuchElementException, TimeoutException
@@ -15,41 +13,42 @@ from time import sleep
 from pathlib import Path
 from bookphucker import Config
 from contextlib import suppress
-from PIL import Image
-from base64 import b64decode
-from collections import deque
 from .exc import RequiresCapcha
-from .utils import find_click, save_cookies, recover_cookies
+from . import engine
+from .capture import Navigation
+from .engine import Region
+from .commonvars import cookies_path, books_path
+from .catalog import Catalog
+from .cookies import CookieStore
+from .utils import find_click, poll
 
 domain = "bookwalker.jp"
+member_url = f"https://member.{domain}"
 
 
-def validate_login(driver: webdriver.Chrome) -> bool:
-    url = f"https://member.{domain}/app/03/my/profile"
-    driver.get(url)
-    with suppress(TimeoutException):
-        WebDriverWait(driver, 1).until(lambda x: "ES0001" in x.page_source)
-        return False
-    try:
-        WebDriverWait(driver, 2).until(EC.url_to_be(url))
-        return True
-    except TimeoutException:
-        return False
+def validate_login(session: requests.Session) -> bool:
+    r = session.get(f"{member_url}/app/03/my/profile",
+                    allow_redirects=False, timeout=10)
+    return r.status_code == 200 and "ES0001" not in r.text
 
 
-def login(driver: webdriver.Chrome, username: str, password: str, error_on_captcha=False):
+def login(driver: webdriver.Chrome, username: str, password: str,
+          error_on_captcha=False, cookies_file: Path = cookies_path):
     """
     Leave username and password empty for manual login
     """
-    if (recover_cookies(driver, f"https://{domain}/")
-        and recover_cookies(driver, f"https://member.{domain}/app/03/my/profile")
-            and validate_login(driver)):
+    store = CookieStore.open(cookies_file)
+    if store.restore(driver, domain) and (
+            store.fresh(domain) or validate_login(store.session(
+                domain, driver.execute_script("return navigator.userAgent")))):
+        store.mark_validated(domain)
+        store.flush()
         logging.info("Recovered cookies")
         return
     driver.delete_all_cookies()
     driver.get(f"https://{domain}/")
     driver.execute_script("sendGa(1,'グローバルナビ','クリック','ヘッダログイン');")
-    driver.get(f"https://member.{domain}/app/03/webstore/cooperation?r=top%2F")
+    driver.get(f"{member_url}/app/03/webstore/cooperation?r=top%2F")
     WebDriverWait(driver, 10).until(
         EC.presence_of_element_located((By.ID, "mailAddress")))
 
@@ -75,7 +74,6 @@ def login(driver: webdriver.Chrome, username: str, password: str, error_on_captc
     else:
         print("Manual login required")
 
-    init_time = time.time()
     timeout = 10
     with suppress(NoSuchElementException):
         if driver.find_element(
@@ -83,34 +81,20 @@ def login(driver: webdriver.Chrome, username: str, password: str, error_on_captc
             "iframe[src^='https://www.recaptcha.net/recaptcha/api2/bframe']"
         ).is_displayed():
             timeout = 180
-    while True:
-        cookies = driver.get_cookies()
-        if any(c["name"] == "bwmember" for c in cookies):
-            break
-        if time.time() - init_time > timeout:
-            raise TimeoutException("Cookies retrieval timeout")
-        sleep(.1)
+    poll(lambda: any(c["name"] == "bwmember" for c in driver.get_cookies()),
+         timeout, message="Cookies retrieval timeout")
 
-    save_cookies(driver, f"https://{domain}/")
-    save_cookies(driver, f"https://member.{domain}/app/03/my/profile")
+    store.capture(driver, domain)
+    store.mark_validated(domain)
+    store.flush()
 
 
-def logout(driver: webdriver.Chrome):
-    driver.get(f"https://member.{domain}/app/03/my/profile")
+def logout(driver: webdriver.Chrome, cookies_file: Path = cookies_path):
+    CookieStore.open(cookies_file).invalidate(domain)
+    driver.get(f"{member_url}/app/03/my/profile")
     find_click(driver, By.CLASS_NAME, "l-header__logout")
 
 
-def wait4loading(driver: webdriver.Chrome, timeout: int = 30):
-    # wait until all loading overlays have disappeared
-    WebDriverWait(driver, timeout).until_not(
-        lambda d: any(e.is_displayed()
-                      for e in d.find_elements(By.CLASS_NAME, "loading"))
-    )
-    # Debug: print the CSS visibility for each loading element
-    print([e.get_attribute("style")
-          for e in driver.find_elements(By.CLASS_NAME, "loading")])
-
-
 def get_menu(driver: webdriver.Chrome) -> str:
     obj_name = driver.execute_script(
         "for (let k in NFBR.a6G.Initializer){"
@@ -118,40 +102,20 @@ def get_menu(driver: webdriver.Chrome) -> str:
     return f"NFBR.a6G.Initializer.{obj_name}.menu"
 
 
-def get_total_pages(driver: webdriver.Chrome):
-    return driver.execute_script(
-        f"return {get_menu(driver)}.model.attributes.a2u.r8q.length")
-
-
 def get_total_spreads(driver: webdriver.Chrome):
     return driver.execute_script(
         f"return {get_menu(driver)}.model.attributes.a2u.r8q.length")
 
-def get_current_page(driver: webdriver.Chrome):
-    pages = driver.execute_script(
-        f"return {get_menu(driver)}.model.attributes.viewera6e.getPageIndex()")
-    return pages+1
-
-
-def get_current_spread(driver: webdriver.Chrome):
-    return 1 + driver.execute_script(
-        f"return {get_menu(driver)}.model.attributes.viewera6e.getSpreadIndex()")
-
 
-def go2page(driver: webdriver.Chrome, page: int):
-    driver.execute_script(f"{get_menu(driver)}.options.a6l.moveToPage({page-1});")
-
-
-def go2spread(driver: webdriver.Chrome, spread: int):
-    page_index = driver.execute_script(
-        f"return {get_menu(driver)}.model.attributes.a2u.r8q[{spread-1}].pageIndex")
-    go2page(driver, page_index+1)
-
-
-def download_book(driver: webdriver.Chrome, cfg: Config, book_uuid: str, overwrite):
+def open_book(driver: webdriver.Chrome, cfg: Config, book_uuid: str,
+              cookies_file: Path = cookies_path) -> tuple[Path, str, int]:
+    """
+    Open the reader of a book and write its `meta.json`,
+    returns the save directory, title and number of spreads
+    """
     logging.info("Downloading book %s", book_uuid)
     driver.get(
-        f"https://member.{domain}/app/03/webstore/cooperation?r=de{book_uuid}%2F")
+        f"{member_url}/app/03/webstore/cooperation?r=de{book_uuid}%2F")
     WebDriverWait(driver, 10).until(
         EC.presence_of_element_located((By.CLASS_NAME, "t-c-product-main-data__title")))
 
@@ -179,12 +143,7 @@ def download_book(driver: webdriver.Chrome, cfg: Config, book_uuid: str, overwri
 
     find_click(driver, By.CLASS_NAME, "t-c-read-button")
 
-    save_dir = Path(f"babies/{title}")
-    save_dir.mkdir(exist_ok=True, parents=True)
-    meta_path = save_dir / "meta.json"
-    meta_path.write_text(json.dumps(
-        {"title": title, "authors": authors},
-        ensure_ascii=False, indent=2), encoding="utf-8")
+    save_dir = Catalog.open().add(book_uuid, "jp", title, authors, books_path)
 
     driver.switch_to.window(driver.window_handles[-1])
 
@@ -194,49 +153,22 @@ def download_book(driver: webdriver.Chrome, cfg: Config, book_uuid: str, overwri
     WebDriverWait(driver, 30).until(
         EC.invisibility_of_element_located((By.CLASS_NAME, "progressbar")))
 
-    init_time = time.time()
-    while True:
-        try:
-            total_spreads = get_total_spreads(driver)
-            break
-        except JavascriptException:
-            if time.time() - init_time > 10:
-                raise TimeoutException("Total spreads retrieval timeout")
-    prev_imgs = deque[bytes](maxlen=2)  # used for checking update for 2 buffers
-    max_retries = 30
+    total_spreads = poll(lambda: get_total_spreads(driver), 10,
+                         ignored=(JavascriptException,),
+                         message="Total spreads retrieval timeout")
     logging.info("Total spreads: %s", total_spreads)
+    return save_dir, title, total_spreads
+
+
+# the viewer moves by spread, through the first page of each
+region = Region("jp", domain, Navigation(
+    position="() => bp.menu.model.attributes.viewera6e.getSpreadIndex()",
+    move_to="target => bp.menu.options.a6l.moveToPage("
+            "bp.menu.model.attributes.a2u.r8q[target].pageIndex)"), open_book)
+
 
-    go2spread(driver, 1)
-    sleep(2)
-
-    for current_spread in track(range(1, total_spreads + 1), description="Downloading", total=total_spreads):
-        retry = 0
-        savename = save_dir / f"page_{current_spread}.png"
-        if savename.exists() and not overwrite:
-            logging.debug("page %s already exists, skipping", current_spread)
-            continue
-        go2spread(driver, current_spread)
-        while get_current_spread(driver) != current_spread:
-            sleep(0.1)
-        sleep(.1)
-        wait4loading(driver)
-        logging.debug("Getting page %s out of %s", current_spread, total_spreads)
-        canvas = driver.find_element(By.CSS_SELECTOR, ".currentScreen canvas")
-        while retry < max_retries:
-            canvas_base64 = driver.execute_script(
-                "return arguments[0].toDataURL('image/png').slice(21);", canvas)
-            img_bytes = b64decode(canvas_base64)
-            img = Image.open(io.BytesIO(img_bytes))
-            if all(all(v == 0 for v in c) for c in img.getdata()):
-                logging.debug("Blank page %s, treated as unloaded page", current_spread)
-            elif img_bytes not in prev_imgs:
-                prev_imgs.append(img_bytes)
-                break
-            retry += 1
-            logging.debug("Retrying page %s (%s/%s)",
-                          current_spread, retry, max_retries)
-            sleep(0.3)
-        if retry == max_retries:
-            logging.warning("Potentially repeated page %s", current_spread)
-        img.save(savename)
-        logging.debug("Saved page %s", current_spread)
+def download_book(driver: webdriver.Chrome, cfg: Config, book_uuid: str, overwrite,
+                  cookies_file: Path = cookies_path, progress: Progress | None = None,
+                  verify: bool = False):
+    engine.download_book(region, driver, cfg, book_uuid, overwrite, cookies_file,
+                         progress, verify)
@@ -0,0 +1,167 @@
+import io
+import os
+import hashlib
+import logging
+import ujson as json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO
+from PIL import Image
+from pydantic import BaseModel
+from .imaging import looks_unloaded, dhash
+from .dedup import PageIndex
+from .utils import write_atomic
+
+# of page files, as captured with any transport
+PAGE_SUFFIXES = (".png", ".webp")
+
+
+class PageEntry(BaseModel):
+    page: int
+    file: str
+    sha1: str
+    size: int
+    width: int
+    height: int
+    captured_at: float
+    phash: str | None = None  # hex difference hash, None for uniform pages
+    bad: bool = False
+
+
+def hash_file(path: Path) -> tuple[str, int]:
+    data = path.read_bytes()
+    return hashlib.sha1(data).hexdigest(), len(data)
+
+
+class Manifest:
+    """
+    Per-book record of saved pages, stored as JSON lines next to `meta.json`.
+    Entries are appended as pages are saved, the last line of a page wins.
+    """
+    filename = "manifest.jsonl"
+
+    def __init__(self, save_dir: Path):
+        self.save_dir = save_dir
+        self.path = save_dir / self.filename
+        self.pages = dict[int, PageEntry]()
+        self._file: IO[str] | None = None
+
+    @classmethod
+    def load(cls, save_dir: Path) -> "Manifest":
+        manifest = cls(save_dir)
+        if not manifest.path.exists():
+            manifest.adopt()
+            return manifest
+        with manifest.path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = PageEntry(**json.loads(line))
+                except ValueError:  # torn last line after a crash
+                    logging.debug("Skipping broken manifest line in %s", manifest.path)
+                    continue
+                manifest.pages[entry.page] = entry
+        return manifest
+
+    def index(self) -> PageIndex:
+        index = PageIndex()
+        # in capture order, the last ones are the recent pages of the index
+        for entry in sorted(self.pages.values(), key=lambda e: e.captured_at):
+            if not entry.bad:
+                index.add(entry.page, entry.sha1,
+                          None if entry.phash is None else int(entry.phash, 16))
+        return index
+
+    def done(self, page: int) -> bool:
+        entry = self.pages.get(page)
+        return entry is not None and not entry.bad
+
+    def append(self, entry: PageEntry):
+        if self._file is None:
+            self._file = self.path.open("a", encoding="utf-8")
+        self.pages[entry.page] = entry
+        self._file.write(json.dumps(entry.model_dump(), ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def save(self):
+        """
+        Rewrite the manifest with one line per page
+        """
+        self.close()
+        lines = (json.dumps(e.model_dump(), ensure_ascii=False) + "\n"
+                 for _, e in sorted(self.pages.items()))
+        write_atomic(self.path, "".join(lines).encode("utf-8"))
+
+    def verify(self, workers: int = os.cpu_count() or 1) -> list[int]:
+        """
+        Re-hash saved pages in parallel, flag missing or changed ones as bad
+        and return their page numbers
+        """
+        def check(entry: PageEntry) -> bool:
+            path = self.save_dir / entry.file
+            if not path.exists():
+                return False
+            return hash_file(path) == (entry.sha1, entry.size)
+
+        entries = list(self.pages.values())
+        with ThreadPoolExecutor(workers) as executor:
+            results = list(executor.map(check, entries))
+        bad = list[int]()
+        for entry, ok in zip(entries, results):
+            if not ok:
+                entry.bad = True
+                bad.append(entry.page)
+        if bad:
+            logging.warning("Pages failed verification: %s", ", ".join(map(str, bad)))
+        self.save()
+        return bad
+
+    def adopt(self, workers: int = os.cpu_count() or 1):
+        """
+        Build a manifest from pages saved before manifests existed,
+        pages that do not decode or look blank are left out
+        """
+        files = [path for suffix in PAGE_SUFFIXES
+                 for path in self.save_dir.glob(f"page_*{suffix}")]
+        if not files:
+            return
+
+        def inspect(path: Path) -> PageEntry | None:
+            page = path.stem.removeprefix("page_")
+            if not page.isdigit():
+                return None
+            data = path.read_bytes()
+            try:
+                img = Image.open(io.BytesIO(data))
+                # as in `process_capture`, WebP drops the alpha of an opaque canvas
+                if looks_unloaded(img, luminance=path.suffix != ".webp"):
+                    return None
+                phash = dhash(img)
+            except (OSError, SyntaxError):
+                return None
+            return PageEntry(page=int(page), file=path.name,
+                             sha1=hashlib.sha1(data).hexdigest(), size=len(data),
+                             width=img.width, height=img.height,
+                             captured_at=path.stat().st_mtime,
+                             phash=None if phash is None else f"{phash:x}")
+
+        with ThreadPoolExecutor(workers) as executor:
+            entries = list(executor.map(inspect, files))
+        for entry in entries:
+            # of a page saved with two transports, the newer one
+            if entry is not None and (entry.page not in self.pages or entry.captured_at
+                                      > self.pages[entry.page].captured_at):
+                self.pages[entry.page] = entry
+        logging.info("Adopted %s of %s existing pages in %s",
+                     len(self.pages), len(files), self.save_dir)
+        self.save()
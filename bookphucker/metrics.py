@@ -0,0 +1,167 @@
+import time
+import threading
+import ujson as json
+from contextlib import contextmanager
+from pathlib import Path
+from .utils import write_atomic
+
+# upper bounds of the Prometheus histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def percentile(samples: list[float], q: float) -> float:
+    """
+    Nearest rank percentile of sorted `samples`
+    """
+    return samples[min(len(samples) - 1, int(len(samples) * q))] if samples else 0
+
+
+class BookMetrics:
+    """
+    Timing spans and counters of one book download, safe to record from any thread
+    """
+
+    def __init__(self, book_uuid: str, region: str):
+        self.book_uuid = book_uuid
+        self.region = region
+        self.title = ''
+        self.save_dir: Path | None = None  # metrics.json goes here once known
+        self.started = time.time()
+        self.finished: float | None = None
+        self.spans = dict[str, list[float]]()
+        self.counters = dict[str, int]()
+        self.lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self.lock:
+            self.spans.setdefault(name, []).append(seconds)
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def span(self, name: str):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - begin)
+
+    def finish(self):
+        self.finished = time.time()
+
+    def summary(self) -> dict:
+        with self.lock:
+            spans = {name: sorted(samples) for name, samples in self.spans.items()}
+            counters = dict(self.counters)
+        elapsed = (self.finished or time.time()) - self.started
+        pages = counters.get("pages", 0)
+        return {
+            "uuid": self.book_uuid,
+            "title": self.title,
+            "region": self.region,
+            "started_at": self.started,
+            "finished_at": self.finished,
+            "seconds": elapsed,
+            "pages_per_second": pages / elapsed if elapsed > 0 else 0,
+            "counters": counters,
+            "spans": {name: {
+                "count": len(samples),
+                "total": sum(samples),
+                "mean": sum(samples) / len(samples),
+                "p50": percentile(samples, 0.5),
+                "p95": percentile(samples, 0.95),
+                "p99": percentile(samples, 0.99),
+                "max": samples[-1],
+            } for name, samples in spans.items() if samples},
+        }
+
+    def write(self, save_dir: Path):
+        """
+        Write the summary as `metrics.json` next to `meta.json`
+        """
+        write_atomic(save_dir / "metrics.json", json.dumps(
+            self.summary(), ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+class Registry:
+    """
+    Totals of every book finished by this process, in the Prometheus text format
+    """
+
+    def __init__(self):
+        self.counters = dict[tuple[str, str], float]()  # (name, labels) -> value
+        # bucket counts, sum, count
+        self.histograms = dict[tuple[str, str], list[float]]()
+        self.lock = threading.Lock()
+
+    def collect(self, book: BookMetrics):
+        labels = f'region="{book.region}"'
+        with book.lock:
+            spans = {name: list(samples) for name, samples in book.spans.items()}
+            counters = dict(book.counters)
+        with self.lock:
+            key = ("bookphucker_books_total", labels)
+            self.counters[key] = self.counters.get(key, 0) + 1
+            for name, value in counters.items():
+                key = (f"bookphucker_{name}_total", labels)
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, samples in spans.items():
+                key = ("bookphucker_span_seconds", f'{labels},span="{name}"')
+                hist = self.histograms.setdefault(key, [0.0] * (len(BUCKETS) + 2))
+                for seconds in samples:
+                    for i, bound in enumerate(BUCKETS):
+                        if seconds <= bound:
+                            hist[i] += 1
+                    hist[-2] += seconds
+                    hist[-1] += 1
+
+    def render(self) -> str:
+        lines = list[str]()
+        with self.lock:
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f"# TYPE {name} counter")
+                lines.extend(f"{name}{{{labels}}} {value:g}"
+                             for (n, labels), value in sorted(self.counters.items())
+                             if n == name)
+            if self.histograms:
+                lines.append("# TYPE bookphucker_span_seconds histogram")
+            for (name, labels), hist in sorted(self.histograms.items()):
+                for bound, n in zip(BUCKETS, hist):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {n:g}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist[-1]:g}')
+                lines.append(f"{name}_sum{{{labels}}} {hist[-2]:g}")
+                lines.append(f"{name}_count{{{labels}}} {hist[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path):
+        """
+        For the node exporter textfile collector, which needs atomic writes
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(path, self.render().encode("utf-8"))
+
+
+registry = Registry()
+
+
+@contextmanager
+def book_metrics(book_uuid: str, region: str, textfile: str | None = None):
+    """
+    Collect metrics of a book download, written out when it finishes, even on failure
+    """
+    metrics = BookMetrics(book_uuid, region)
+    try:
+        yield metrics
+    except BaseException:
+        metrics.count("failures")
+        raise
+    finally:
+        metrics.finish()
+        if metrics.save_dir is not None:
+            metrics.write(metrics.save_dir)
+        registry.collect(metrics)
+        if textfile:
+            registry.write(Path(textfile))
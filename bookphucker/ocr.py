@@ -0,0 +1,184 @@
+import os
+import argparse
+import logging
+import sqlite3
+import subprocess
+import ujson as json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from rich.progress import track
+from .commonvars import books_path, ocr_db_path
+from .manifest import Manifest
+
+LANGUAGES = {"jp": "jpn+jpn_vert", "tw": "chi_tra+chi_tra_vert"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    book_uuid TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    book_uuid TEXT NOT NULL REFERENCES books(book_uuid),
+    page INTEGER NOT NULL,
+    sha1 TEXT NOT NULL,
+    UNIQUE (book_uuid, page)
+);
+-- trigram tokenizer, since CJK text has no spaces between words
+CREATE VIRTUAL TABLE IF NOT EXISTS page_text USING fts5(text, tokenize='trigram');
+"""
+
+
+def connect(path: Path = ocr_db_path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+def ocr_image(path: str, lang: str) -> str:
+    """
+    Run tesseract on a single page, in a worker process
+    """
+    env = dict(os.environ, OMP_THREAD_LIMIT="1")  # parallelism comes from the pool
+    result = subprocess.run(["tesseract", path, "stdout", "-l", lang],
+                            capture_output=True, env=env, check=True)
+    return result.stdout.decode("utf-8", errors="replace").strip()
+
+
+def book_key(book_dir: Path, meta: dict) -> str:
+    # books downloaded before meta.json recorded UUIDs are keyed by directory
+    return meta.get("uuid") or book_dir.name
+
+
+def pending_pages(db: sqlite3.Connection, book_dir: Path, force: bool = False
+                  ) -> tuple[str, dict, list[tuple[int, str, Path]]]:
+    """
+    Pages of a book whose hash differs from the indexed one
+    """
+    meta = json.loads((book_dir / "meta.json").read_text(encoding="utf-8"))
+    key = book_key(book_dir, meta)
+    indexed = dict(db.execute(
+        "SELECT page, sha1 FROM pages WHERE book_uuid = ?", (key,)).fetchall())
+    manifest = Manifest.load(book_dir)
+    todo = [(e.page, e.sha1, book_dir / e.file)
+            for _, e in sorted(manifest.pages.items())
+            if not e.bad and (force or indexed.get(e.page) != e.sha1)]
+    return key, meta, todo
+
+
+def store_page(db: sqlite3.Connection, key: str, page: int, sha1: str, text: str):
+    row = db.execute("SELECT id FROM pages WHERE book_uuid = ? AND page = ?",
+                     (key, page)).fetchone()
+    if row is None:
+        page_id = db.execute(
+            "INSERT INTO pages (book_uuid, page, sha1) VALUES (?, ?, ?)",
+            (key, page, sha1)).lastrowid
+    else:
+        page_id = row[0]
+        db.execute("UPDATE pages SET sha1 = ? WHERE id = ?", (sha1, page_id))
+        db.execute("DELETE FROM page_text WHERE rowid = ?", (page_id,))
+    db.execute("INSERT INTO page_text (rowid, text) VALUES (?, ?)", (page_id, text))
+
+
+def ocr_books(book_dirs: list[Path], lang: str | None = None,
+              workers: int = os.cpu_count() or 1, force: bool = False,
+              db_path: Path = ocr_db_path):
+    """
+    OCR new or changed pages of `book_dirs` in a process pool
+    and index the text for full-text search
+    """
+    db = connect(db_path)
+    jobs = list[tuple[str, int, str, Path, str]]()
+    for book_dir in book_dirs:
+        key, meta, todo = pending_pages(db, book_dir, force)
+        db.execute(
+            "INSERT OR REPLACE INTO books (book_uuid, title, path) VALUES (?, ?, ?)",
+            (key, meta["title"], str(book_dir)))
+        book_lang = lang or LANGUAGES.get(meta.get("region", "jp"), LANGUAGES["jp"])
+        jobs.extend((key, page, sha1, path, book_lang) for page, sha1, path in todo)
+    db.commit()
+    logging.info("%s pages to OCR", len(jobs))
+    if not jobs:
+        return
+
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {executor.submit(ocr_image, str(path), job_lang): (key, page, sha1)
+                   for key, page, sha1, path, job_lang in jobs}
+        for i, future in enumerate(track(as_completed(futures), description="OCR",
+                                         total=len(futures)), 1):
+            key, page, sha1 = futures[future]
+            try:
+                text = future.result()
+            except subprocess.CalledProcessError as e:
+                logging.error("OCR failed on %s page %s: %s", key, page,
+                              e.stderr.decode(errors="replace").strip())
+                continue
+            store_page(db, key, page, sha1, text)
+            if i % 100 == 0:
+                db.commit()
+    db.commit()
+    db.close()
+
+
+def search(query: str, limit: int = 20, db_path: Path = ocr_db_path
+           ) -> list[tuple[str, str, int, str]]:
+    """
+    Return (book UUID, title, page, snippet) of pages matching `query`
+    """
+    db = connect(db_path)
+    if len(query) >= 3:
+        rows = db.execute(
+            "SELECT p.book_uuid, b.title, p.page,"
+            " snippet(page_text, 0, '[', ']', '…', 16)"
+            " FROM page_text JOIN pages p ON p.id = page_text.rowid"
+            " JOIN books b ON b.book_uuid = p.book_uuid"
+            " WHERE page_text MATCH ? ORDER BY rank LIMIT ?",
+            ('"' + query.replace('"', '""') + '"', limit)).fetchall()
+    else:
+        # trigrams cannot match shorter queries, fall back to a scan
+        rows = [(book_uuid, title, page, short_snippet(text, query))
+                for book_uuid, title, page, text in db.execute(
+                    "SELECT p.book_uuid, b.title, p.page, page_text.text"
+                    " FROM page_text JOIN pages p ON p.id = page_text.rowid"
+                    " JOIN books b ON b.book_uuid = p.book_uuid"
+                    " WHERE instr(page_text.text, ?) > 0"
+                    " ORDER BY p.book_uuid, p.page LIMIT ?", (query, limit))]
+    db.close()
+    return rows
+
+
+def short_snippet(text: str, query: str, context: int = 16) -> str:
+    i = text.find(query)
+    start, end = max(0, i - context), i + len(query) + context
+    return (("…" if start else "") + text[start:i] + f"[{query}]"
+            + text[i + len(query):end] + ("…" if end < len(text) else ""))
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="bookphucker ocr")
+    parser.add_argument("books",
+                        help="Book directories, defaults to every downloaded book",
+                        nargs='*', type=Path)
+    parser.add_argument("-l", "--lang", help="Tesseract languages, defaults by region")
+    parser.add_argument("-j", "--jobs", help="Number of OCR processes",
+                        type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--force", help="OCR every page again", action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    books = args.books or sorted(p.parent for p in books_path.glob("*/meta.json"))
+    ocr_books(books, args.lang, args.jobs, args.force)
+
+
+def search_main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="bookphucker search")
+    parser.add_argument("query", help="Text to look for in OCRed pages")
+    parser.add_argument("-n", "--limit", help="Maximum number of results",
+                        type=int, default=20)
+    args = parser.parse_args(argv)
+
+    for book_uuid, title, page, snippet in search(args.query, args.limit):
+        print(f"{title} ({book_uuid}) p.{page}: {snippet}")
@@ -0,0 +1,166 @@
+import io
+import os
+import time
+import hashlib
+import logging
+from base64 import b64decode
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Sequence
+from PIL import Image
+from rich.progress import Progress
+from .capture import Frame
+from .imaging import looks_unloaded, dhash
+from .dedup import PageIndex
+from .metrics import BookMetrics
+from .manifest import Manifest, PageEntry, PAGE_SUFFIXES
+from .utils import page_progress, write_atomic
+
+
+@dataclass
+class Capture:
+    page: int
+    savename: Path
+    attempt: int
+    frame: Frame
+    final: bool = False  # save whatever we got, retries are exhausted
+
+
+def process_capture(capture: Capture, metrics: BookMetrics) -> PageEntry | None:
+    """
+    Decode, validate, hash and write a captured page, runs off the WebDriver thread.
+    Raw pixels are encoded as PNG here,
+    other formats are saved as the browser encoded them.
+    Returns None for pages that are still loading,
+    on the final attempt they are saved anyway but flagged as bad.
+    """
+    frame = capture.frame
+    with metrics.span("decode"):
+        img_bytes = b"".join(b64decode(chunk) for chunk in frame.chunks)
+        if frame.format == "rgba":
+            img = Image.frombuffer("RGBA", (frame.width, frame.height), img_bytes,
+                                   "raw", "RGBA", 0, 1)
+        else:
+            img = Image.open(io.BytesIO(img_bytes))
+            img.load()
+    with metrics.span("validate"):
+        # an opaque canvas comes back from WebP without alpha, so it was drawn on
+        unloaded = looks_unloaded(img, luminance=frame.format != "webp")
+        if unloaded and not capture.final:
+            return None
+        phash = dhash(img)
+    if frame.format == "rgba":
+        with metrics.span("encode"):
+            buf = io.BytesIO()
+            img.save(buf, "PNG")
+            img_bytes = buf.getvalue()
+    with metrics.span("save"):
+        write_atomic(capture.savename, img_bytes)
+        # left by a run with another transport
+        for suffix in PAGE_SUFFIXES:
+            if suffix != capture.savename.suffix:
+                capture.savename.with_suffix(suffix).unlink(missing_ok=True)
+    return PageEntry(page=capture.page, file=capture.savename.name,
+                     sha1=hashlib.sha1(img_bytes).hexdigest(), size=len(img_bytes),
+                     width=img.width, height=img.height, captured_at=time.time(),
+                     phash=None if phash is None else f"{phash:x}", bad=unloaded)
+
+
+def capture_pages(grab: Callable[[int, bool, bool], Frame], pages: Sequence[int],
+                  save_dir: Path, overwrite: bool = False, verify: bool = False,
+                  description: str = "Downloading",
+                  progress: Progress | None = None, max_retries: int = 30,
+                  workers: int = min(4, os.cpu_count() or 1), max_pending: int = 0,
+                  metrics: BookMetrics | None = None,
+                  plan: Callable[[list[int]], list[int]] | None = None) -> int:
+    """
+    Capture `pages` with `grab(page, retry, final)` on the calling (WebDriver) thread,
+    while a bounded thread pool decodes, validates and writes them.
+    Unloaded or repeated pages are queued again until `max_retries` is reached,
+    frames the browser did not send for being blank or unchanged right away.
+    Pages already in the book's manifest are skipped unless `overwrite`,
+    `verify` re-hashes them first so changed or missing files are fetched again.
+    At most `max_pending` captures are held in memory, defaults to twice the workers.
+    Page timings, retries and blank frames are counted in `metrics`.
+    `plan` orders the pages left to capture, e.g. to take turns between viewers.
+    Returns how many of `pages` are saved.
+    """
+    max_pending = max_pending or workers * 2
+    metrics = metrics or BookMetrics('', '')
+    todo = deque[tuple[int, int]]()  # (page, attempt)
+    in_flight = dict[Future, Capture]()  # in submission order
+
+    manifest = Manifest.load(save_dir)
+    if verify and not overwrite:
+        manifest.verify()
+    index = PageIndex() if overwrite else manifest.index()
+
+    with page_progress(len(pages), description, progress) as advance, manifest, \
+            ThreadPoolExecutor(workers, thread_name_prefix="page") as executor:
+        left = list[int]()
+        for page in pages:
+            if manifest.done(page) and not overwrite:
+                logging.debug("Page %s already exists, skipping", page)
+                metrics.count("skipped_pages")
+                advance()
+            else:
+                left.append(page)
+        todo.extend((page, 0) for page in (plan(left) if plan else left))
+
+        def retry(page: int, attempt: int):
+            metrics.count("retries")
+            logging.debug("Retrying page %s (%s/%s)", page, attempt, max_retries)
+            # retry soon, while the viewer still has the page around
+            todo.appendleft((page, attempt))
+
+        def collect(future: Future):
+            capture = in_flight.pop(future)
+            entry = future.result()
+            if entry is None:
+                logging.debug("Blank page %s, treated as unloaded page", capture.page)
+                metrics.count("blank_frames")
+            else:
+                phash = None if entry.phash is None else int(entry.phash, 16)
+                repeated = index.find(capture.page, entry.sha1, phash)
+                if repeated is None or capture.final:
+                    if repeated is not None or entry.bad:
+                        # kept for a look, but fetched again by the next run
+                        logging.warning("Page %s still %s, saved as bad", capture.page,
+                                        "unloaded" if entry.bad else "repeated")
+                        metrics.count("forced_pages")
+                        entry.bad = True
+                    else:
+                        index.add(capture.page, entry.sha1, phash)
+                        metrics.count("pages")
+                    manifest.append(entry)
+                    logging.debug("Saved page %s", capture.page)
+                    advance()
+                    return
+                logging.debug("Page %s repeats page %s, stale buffer",
+                              capture.page, repeated)
+                metrics.count("stale_frames")
+            retry(capture.page, capture.attempt + 1)
+
+        while todo or in_flight:
+            if todo and len(in_flight) < max_pending:
+                page, attempt = todo.popleft()
+                logging.debug("Getting page %s out of %s", page, len(pages))
+                final = attempt >= max_retries
+                frame = grab(page, attempt > 0, final)
+                if frame.skipped:
+                    logging.debug("Page %s was %s, not sent", page, frame.skipped)
+                    metrics.count("blank_frames" if frame.skipped == "blank"
+                                  else "stale_frames")
+                    retry(page, attempt + 1)
+                    continue
+                savename = save_dir / f"page_{page}.{frame.suffix}"
+                capture = Capture(page, savename, attempt, frame, final=final)
+                in_flight[executor.submit(process_capture, capture, metrics)] = capture
+            else:
+                wait([next(iter(in_flight))])
+            # results are handled in capture order, so repeated buffers are told apart
+            while in_flight and (head := next(iter(in_flight))).done():
+                collect(head)
+    return sum(manifest.done(page) for page in pages)
@@ -0,0 +1,98 @@
+import logging
+import threading
+from pathlib import Path
+from queue import Queue, Empty
+from types import ModuleType
+from rich.progress import Progress
+from bookphucker import Config
+from .accounts import AccountPool
+from .exc import RequiresCapcha
+from .supervisor import Supervisor
+
+
+class Worker(threading.Thread):
+    """
+    A browser session on an account leased from the pool, with the account's profile
+    and cookie jar, pulling book UUIDs from a queue shared with the other workers
+    """
+
+    def __init__(self, index: int, cfg: Config, books: Queue[str], site: ModuleType,
+                 accounts: AccountPool, overwrite: bool, verify: bool,
+                 progress: Progress, failures: dict[str, BaseException],
+                 startup_lock: threading.Lock):
+        super().__init__(name=f"worker-{index}", daemon=True)
+        self.index = index
+        self.cfg = cfg
+        self.books = books
+        self.overwrite = overwrite
+        self.verify = verify
+        self.progress = progress
+        self.failures = failures
+        self.startup_lock = startup_lock
+        self.supervisor = Supervisor(cfg, site, new_driver=self.new_driver,
+                                     name=self.name, accounts=accounts)
+
+    def new_driver(self, profile_dir: Path | None):
+        # undetected_chromedriver patches the driver binary on startup
+        with self.startup_lock:
+            return self.cfg.get_webdriver(profile_dir)
+
+    def run(self):
+        try:
+            self.supervisor.start()
+        except Exception as e:
+            logging.error("Worker %s failed to start: %r", self.index, e)
+            return
+        try:
+            while True:
+                try:
+                    book_uuid = self.books.get_nowait()
+                except Empty:
+                    break
+                try:
+                    self.supervisor.download(book_uuid, self.overwrite, self.verify,
+                                             self.progress)
+                except RequiresCapcha as e:
+                    logging.error("Worker %s needs a captcha solved, stopping",
+                                  self.index)
+                    self.failures[book_uuid] = e
+                    break
+                except Exception as e:
+                    logging.error("Worker %s failed on book %s: %r",
+                                  self.index, book_uuid, e)
+                    self.failures[book_uuid] = e
+                finally:
+                    self.books.task_done()
+        finally:
+            self.supervisor.quit()
+
+
+def download_books(cfg: Config, book_uuids: list[str], workers: int, site: ModuleType,
+                   username: str, password: str, overwrite: bool = False,
+                   verify: bool = False) -> dict[str, BaseException]:
+    """
+    Download books with a pool of `workers` browser sessions, one per account at most,
+    `workers` of 0 runs one per account. Returns failures keyed by book UUID
+    """
+    accounts = AccountPool.from_config(cfg, username, password, site.region.name)
+    if workers > len(accounts):
+        logging.warning("Running %s workers, one per account", len(accounts))
+    workers = min(workers or len(accounts), len(accounts))
+    books = Queue[str]()
+    for book_uuid in book_uuids:
+        books.put(book_uuid)
+    failures = dict[str, BaseException]()
+    startup_lock = threading.Lock()
+    with Progress() as progress:
+        pool = [Worker(i, cfg, books, site, accounts,
+                       overwrite, verify, progress, failures, startup_lock)
+                for i in range(min(workers, len(book_uuids)))]
+        for worker in pool:
+            worker.start()
+        for worker in pool:
+            worker.join()
+    # books left behind when every worker failed to log in
+    while not books.empty():
+        book_uuid = books.get_nowait()
+        failures[book_uuid] = RuntimeError("No worker available")
+    return failures
@@ -0,0 +1,270 @@
+import io
+import os
+import argparse
+import hashlib
+import logging
+import ujson as json
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Literal, cast
+from PIL import Image, ImageChops
+from pydantic import BaseModel
+from rich.progress import track
+from .commonvars import books_path
+from .manifest import Manifest
+from .utils import write_atomic
+
+Format = Literal["webp", "png"]
+Direction = Literal["rtl", "ltr"]
+Color = float | tuple[int, ...]  # a pixel, a number for single band images
+
+processed_dirname = "processed"
+index_filename = "index.json"
+
+
+class Options(BaseModel):
+    format: Format = "webp"
+    trim: bool = True
+    split: bool = True
+    direction: Direction = "rtl"
+    tolerance: int = 16  # how far from the border colour still counts as border
+    spread_ratio: float = 1.2  # width / height above which a page is taken for a spread
+
+
+class Output(BaseModel):
+    file: str
+    sha1: str
+    size: int
+    width: int
+    height: int
+
+
+class Processed(BaseModel):
+    sha1: str  # of the source page
+    outputs: list[Output]
+
+
+def border_color(img: Image.Image) -> Color:
+    """
+    Most common colour of the four corners
+    """
+    w, h = img.size
+    corners = [cast(Color, img.getpixel(xy))
+               for xy in ((0, 0), (w - 1, 0), (0, h - 1), (w - 1, h - 1))]
+    return max(corners, key=corners.count)
+
+
+def ink(img: Image.Image, color: Color, tolerance: int) -> Image.Image:
+    """
+    Mask of the pixels differing from `color` by more than `tolerance` in any band
+    """
+    diff = ImageChops.difference(img, Image.new(img.mode, img.size, color))
+    bands = diff.split()
+    mask = bands[0]
+    for band in bands[1:]:
+        mask = ImageChops.lighter(mask, band)
+    return mask.point(lambda v: 255 if v > tolerance else 0)
+
+
+def trim(img: Image.Image, tolerance: int) -> Image.Image:
+    bbox = ink(img, border_color(img), tolerance).getbbox()
+    return img.crop(bbox) if bbox else img
+
+
+def find_gutter(img: Image.Image, tolerance: int, band: float = 0.1) -> int:
+    """
+    Column between the two pages of a spread: the emptiest column
+    within `band` of the middle, or the middle itself for art running across
+    """
+    w, h = img.size
+    mask = ink(img, border_color(img), tolerance)
+    # mean ink of every column in one C pass
+    columns = mask.resize((w, 1), Image.Resampling.BOX).tobytes()
+    lo, hi = int(w * (0.5 - band)), int(w * (0.5 + band)) + 1
+    middle = columns[lo:hi]
+    if not middle or min(middle) > 8:
+        return w // 2
+    best = min(middle)
+    # centre of the run of emptiest columns closest to the middle
+    centres = list[int]()
+    start: int | None = None
+    for i, v in enumerate([*middle, -1]):  # the sentinel ends the last run
+        if v == best and start is None:
+            start = i
+        elif v != best and start is not None:
+            centres.append(lo + (start + i - 1) // 2)
+            start = None
+    return min(centres, key=lambda x: abs(x - w // 2))
+
+
+def optimize(img: Image.Image) -> Image.Image:
+    """
+    Drop bands that carry nothing, losslessly: opaque alpha and grey colour
+    """
+    if img.mode in ("RGBA", "LA") and img.getchannel("A").getextrema() == (255, 255):
+        img = img.convert(img.mode[:-1])
+    if img.mode == "RGB":
+        r, g, b = img.split()
+        if (ImageChops.difference(r, g).getbbox() is None
+                and ImageChops.difference(r, b).getbbox() is None):
+            img = r
+    return img
+
+
+def encode(img: Image.Image, fmt: Format) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "webp":
+        img.save(buf, "WEBP", lossless=True, quality=100, method=4)
+    else:
+        img.save(buf, "PNG", optimize=True)
+    return buf.getvalue()
+
+
+def process_page(src: str, out_dir: str, stem: str, options: Options) -> list[Output]:
+    """
+    Trim, split and recompress a single page, in a worker process
+    """
+    with Image.open(src) as opened:
+        img = opened.convert("RGBA") if opened.mode == "P" else opened.copy()
+    if options.trim:
+        img = trim(img, options.tolerance)
+    parts = [img]
+    if options.split and img.width > img.height * options.spread_ratio:
+        x = find_gutter(img, options.tolerance)
+        left = img.crop((0, 0, x, img.height))
+        right = img.crop((x, 0, img.width, img.height))
+        parts = [right, left] if options.direction == "rtl" else [left, right]
+        if options.trim:
+            parts = [trim(part, options.tolerance) for part in parts]
+    outputs = list[Output]()
+    for i, part in enumerate(parts):
+        data = encode(optimize(part), options.format)
+        name = f"{stem}{'ab'[i] if len(parts) > 1 else ''}.{options.format}"
+        write_atomic(Path(out_dir) / name, data)
+        outputs.append(Output(file=name, sha1=hashlib.sha1(data).hexdigest(),
+                              size=len(data), width=part.width, height=part.height))
+    return outputs
+
+
+def load_index(out_dir: Path, options: Options) -> dict[int, Processed]:
+    path = out_dir / index_filename
+    if not path.exists():
+        return {}
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except ValueError:
+        return {}
+    if data.get("options") != options.model_dump():
+        return {}  # processed differently, start over
+    return {int(page): Processed(**p) for page, p in data["pages"].items()}
+
+
+def save_index(out_dir: Path, options: Options, pages: dict[int, Processed]):
+    write_atomic(out_dir / index_filename, json.dumps({
+        "options": options.model_dump(),
+        "pages": {str(page): p.model_dump() for page, p in sorted(pages.items())},
+    }, indent=2).encode("utf-8"))
+
+
+def process_jobs(jobs: list[tuple[Path, int, str, Path]],
+                 indexes: dict[Path, dict[int, Processed]],
+                 manifests: dict[Path, Manifest], options: Options, workers: int):
+    width = {book_dir: max(4, len(str(max(manifest.pages, default=0))))
+             for book_dir, manifest in manifests.items()}
+    left = Counter(book_dir for book_dir, *_ in jobs)
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {executor.submit(process_page, str(src),
+                                   str(book_dir / processed_dirname),
+                                   f"{page:0{width[book_dir]}d}", options):
+                   (book_dir, page, sha1) for book_dir, page, sha1, src in jobs}
+        for future in track(as_completed(futures), description="Processing",
+                            total=len(futures)):
+            book_dir, page, sha1 = futures[future]
+            left[book_dir] -= 1
+            index = indexes[book_dir]
+            try:
+                outputs = future.result()
+            except Exception as e:
+                # a page that can not be processed should not lose the others
+                logging.error("Failed to process %s page %s: %r",
+                              book_dir.name, page, e)
+            else:
+                old = index.get(page)
+                for output in old.outputs if old else []:
+                    if output.file not in {o.file for o in outputs}:
+                        stale = book_dir / processed_dirname / output.file
+                        stale.unlink(missing_ok=True)
+                index[page] = Processed(sha1=sha1, outputs=outputs)
+            if not left[book_dir]:
+                save_index(book_dir / processed_dirname, options, index)
+
+
+def process_books(book_dirs: list[Path], options: Options,
+                  workers: int = os.cpu_count() or 1, force: bool = False):
+    """
+    Process the pages of `book_dirs` into `processed/` in a process pool,
+    skipping pages whose source hash has not changed since the last run
+    """
+    indexes = dict[Path, dict[int, Processed]]()
+    manifests = {book_dir: Manifest.load(book_dir) for book_dir in book_dirs}
+    jobs = list[tuple[Path, int, str, Path]]()  # (book, page, source sha1, source file)
+    for book_dir in book_dirs:
+        out_dir = book_dir / processed_dirname
+        out_dir.mkdir(exist_ok=True)
+        index = indexes[book_dir] = {} if force else load_index(out_dir, options)
+        manifest = manifests[book_dir]
+        for page, entry in sorted(manifest.pages.items()):
+            done = index.get(page)
+            if entry.bad or (done and done.sha1 == entry.sha1 and all(
+                    (out_dir / o.file).exists() for o in done.outputs)):
+                continue
+            jobs.append((book_dir, page, entry.sha1, book_dir / entry.file))
+        # pages gone from the manifest
+        for page in set(index) - set(manifest.pages):
+            for output in index.pop(page).outputs:
+                (out_dir / output.file).unlink(missing_ok=True)
+    logging.info("%s pages to process", len(jobs))
+
+    try:
+        if jobs:
+            process_jobs(jobs, indexes, manifests, options, workers)
+    finally:
+        # whatever finished is kept, even if the run is cut short
+        for book_dir, index in indexes.items():
+            save_index(book_dir / processed_dirname, options, index)
+
+    for book_dir, index in indexes.items():
+        before = sum(e.size for e in manifests[book_dir].pages.values()
+                     if e.page in index)
+        after = sum(o.size for p in index.values() for o in p.outputs)
+        if before:
+            logging.info("%s: %s pages, %.1f MiB -> %.1f MiB", book_dir.name,
+                         sum(len(p.outputs) for p in index.values()),
+                         before / 2**20, after / 2**20)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="bookphucker process")
+    parser.add_argument("books",
+                        help="Book directories, defaults to every downloaded book",
+                        nargs='*', type=Path)
+    parser.add_argument("-f", "--format", help="Lossless output format",
+                        default="webp", choices=["webp", "png"])
+    parser.add_argument("-j", "--jobs", help="Number of processes",
+                        type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--no-trim", help="Keep uniform borders", action="store_true")
+    parser.add_argument("--no-split", help="Keep spreads whole", action="store_true")
+    parser.add_argument("--ltr", help="Left page first when splitting spreads",
+                        action="store_true")
+    parser.add_argument("--tolerance", help="Colour difference still counted as border",
+                        type=int, default=Options().tolerance)
+    parser.add_argument("--force", help="Process every page again", action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    options = Options(format=args.format, trim=not args.no_trim,
+                      split=not args.no_split, direction="ltr" if args.ltr else "rtl",
+                      tolerance=args.tolerance)
+    books = args.books or sorted(p.parent for p in books_path.glob("*/meta.json"))
+    process_books(books, options, args.jobs, args.force)
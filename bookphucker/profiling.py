@@ -0,0 +1,42 @@
+import sys
+import time
+from contextlib import contextmanager
+
+
+class PhaseTimer:
+    """
+    Wall clock time of named phases, printed by `report` when enabled
+    """
+
+    def __init__(self, enabled: bool = False, started: float | None = None):
+        self.enabled = enabled
+        self.phases = list[tuple[str, float]]()
+        self.started = time.perf_counter() if started is None else started
+        self.last = self.started
+
+    def mark(self, name: str):
+        """
+        Record the time since the previous mark (or the start) as phase `name`
+        """
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    @contextmanager
+    def phase(self, name: str):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.last = time.perf_counter()
+            self.phases.append((name, self.last - begin))
+
+    def report(self):
+        if not self.enabled:
+            return
+        width = max((len(name) for name, _ in self.phases), default=0)
+        print("Startup profile:", file=sys.stderr)
+        for name, seconds in self.phases:
+            print(f"  {name:<{width}}  {seconds * 1000:>9.1f} ms", file=sys.stderr)
+        total = time.perf_counter() - self.started
+        print(f"  {'total':<{width}}  {total * 1000:>9.1f} ms", file=sys.stderr)
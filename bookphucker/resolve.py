@@ -0,0 +1,140 @@
+import sys
+import logging
+import threading
+import ujson as json
+from pathlib import Path
+from typing import Any, Iterable
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from .commonvars import cache_path
+
+products_path = cache_path / "tw_products.json"
+
+
+class ProductCache:
+    """
+    tw product IDs and book info keyed by book UUID (`cid`),
+    loaded once per process so repeated lookups need no network
+    """
+    _caches = dict[Path, "ProductCache"]()
+    _lock = threading.Lock()
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.books = dict[str, dict[str, Any]]()
+        self.products = dict[str, str]()  # product ID -> book UUID
+        self.lock = threading.Lock()
+        self.dirty = False
+        if path.exists():
+            try:
+                self.books = json.loads(path.read_text(encoding="utf-8"))
+            except ValueError:
+                logging.warning("Ignoring broken product cache %s", path)
+        for book_uuid, info in self.books.items():
+            self.products[info["product_id"]] = book_uuid
+
+    @classmethod
+    def open(cls, path: Path = products_path) -> "ProductCache":
+        with cls._lock:
+            cache = cls._caches.get(path)
+            if cache is None:
+                cache = cls._caches[path] = cls(path)
+            return cache
+
+    def book_uuid(self, product_id: str) -> str | None:
+        return self.products.get(product_id)
+
+    def book(self, book_uuid: str) -> dict[str, Any] | None:
+        return self.books.get(book_uuid)
+
+    def add(self, book_uuid: str, product_id: str, **info):
+        with self.lock:
+            entry = {**self.books.get(book_uuid, {}), "product_id": product_id, **info}
+            if entry == self.books.get(book_uuid):
+                return
+            self.books[book_uuid] = entry
+            self.products[product_id] = book_uuid
+            self.dirty = True
+
+    def save(self):
+        from .utils import write_atomic
+        with self.lock:
+            if not self.dirty:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(self.path, json.dumps(self.books, ensure_ascii=False,
+                                               indent=2).encode("utf-8"))
+            self.dirty = False
+
+
+def tw_book_uuid(product_id: str, session=None) -> str:
+    """
+    Follow the trial viewer redirect of a tw product to the book UUID
+    """
+    cache = ProductCache.open()
+    book_uuid = cache.book_uuid(product_id)
+    if book_uuid is None:
+        if session is None:
+            import requests
+            session = requests.Session()
+        r = session.head(
+            f"https://www.bookwalker.com.tw/browserViewer/{product_id}/trial",
+            timeout=10)
+        book_uuid = parse_qs(urlparse(r.headers["Location"]).query)["cid"][0]
+        logging.debug("Product %s is book %s", product_id, book_uuid)
+        cache.add(book_uuid, product_id)
+    return book_uuid
+
+
+def resolve_book(book_page: str, session=None) -> tuple[str, str | None, str]:
+    """
+    Book UUID, region (None when it cannot be told from the input)
+    and tw product ID of a book page url or UUID
+    """
+    if "bookwalker" not in book_page:
+        return book_page.strip('/')[-36:], None, ''
+    if not book_page.startswith("http"):
+        book_page = "https://" + book_page
+    book_url = urlparse(book_page)
+    if ".com.tw" in (book_url.hostname or ''):
+        if book_url.path.startswith("/product/"):
+            book_id = book_url.path.removeprefix("/product/").split("/")[0]
+            return tw_book_uuid(book_id, session), "tw", book_id
+        book_uuid = parse_qs(book_url.query)["cid"][0]
+        return book_uuid.strip('/')[-36:], "tw", ''
+    return book_url.path.strip('/')[-36:], "jp", ''
+
+
+def resolve_books(book_pages: list[str], workers: int = 8
+                  ) -> list[tuple[str, str | None, str]]:
+    """
+    Resolve `book_pages` concurrently over one pooled session, in order
+    """
+    session = None
+    cache = ProductCache.open()
+    if any(".com.tw/product/" in page and
+           cache.book_uuid(page.split("/product/")[1].split("/")[0]) is None
+           for page in book_pages):
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+    with ThreadPoolExecutor(workers) as executor:
+        results = list(executor.map(lambda page: resolve_book(page, session),
+                                    book_pages))
+    cache.save()
+    return results
+
+
+def read_book_list(paths: Iterable[str]) -> list[str]:
+    """
+    Book page urls or UUIDs from files ("-" for stdin), one per line,
+    blank lines and lines starting with # are skipped
+    """
+    books = list[str]()
+    for path in paths:
+        text = (sys.stdin.read() if path == "-"
+                else Path(path).read_text(encoding="utf-8"))
+        books.extend(line.strip() for line in text.splitlines()
+                     if line.strip() and not line.lstrip().startswith("#"))
+    return books
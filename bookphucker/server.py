@@ -0,0 +1,474 @@
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+import http.client
+import ujson as json
+from uuid import uuid4
+from typing import Literal
+from pathlib import Path
+from queue import Queue
+from importlib import import_module
+from contextlib import suppress
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from pydantic import BaseModel, Field
+from rich.progress import Progress
+from .accounts import AccountPool
+from .catalog import Catalog
+from .commonvars import config_path
+from .metrics import registry
+from .resolve import resolve_books, read_book_list
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8420
+
+JobState = Literal["queued", "running", "done", "failed", "cancelled"]
+
+
+class Job(BaseModel):
+    id: str = Field(default_factory=lambda: uuid4().hex[:12])
+    book_uuid: str
+    region: str
+    overwrite: bool = False
+    verify: bool = False
+    state: JobState = "queued"
+    error: str | None = None
+    submitted_at: float = Field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+
+
+class Session(threading.Thread):
+    """
+    A logged in browser kept open for one region on an account leased from
+    the region's pool, running jobs from its queue until it gets None
+    """
+
+    def __init__(self, name: str, server: "Server", region: str,
+                 jobs: Queue[Job | None]):
+        from .supervisor import Supervisor
+        super().__init__(name=name, daemon=True)
+        self.server = server
+        self.region = region
+        self.jobs = jobs
+        self.supervisor = Supervisor(server.cfg, import_module(f"bookphucker.{region}"),
+                                     new_driver=self.new_driver, name=name,
+                                     accounts=server.accounts[region])
+        self.state = "starting"
+
+    def new_driver(self, profile_dir: Path | None):
+        with self.server.startup_lock:
+            return self.server.cfg.get_webdriver(profile_dir)
+
+    def run(self):
+        try:
+            self.supervisor.start()
+        except Exception as e:
+            logging.error("%s failed to start: %r", self.name, e)
+            self.state = "failed"
+            self.server.session_failed(self)
+            return
+        self.state = "idle"
+        try:
+            while (job := self.jobs.get()) is not None:
+                if not self.server.begin(job):
+                    continue
+                self.state = "busy"
+                try:
+                    # restarts the browser if it is gone,
+                    # and retries the book on failures
+                    self.supervisor.download(job.book_uuid, job.overwrite, job.verify,
+                                             self.server.progress)
+                except Exception as e:
+                    logging.error("%s failed on book %s: %r",
+                                  self.name, job.book_uuid, e)
+                    self.server.finish(job, e)
+                else:
+                    self.server.finish(job)
+                finally:
+                    self.state = "idle"
+        finally:
+            self.state = "stopped"
+            self.supervisor.quit()
+
+
+class Server:
+    """
+    Keeps logged in browser sessions open and feeds them download jobs.
+    Their progress bars share `progress`, rich renders one live display at a time
+    """
+
+    def __init__(self, cfg, username: str, password: str,
+                 regions: list[str], workers: int = 1,
+                 progress: Progress | None = None):
+        self.cfg = cfg
+        self.progress = progress or Progress()
+        self.jobs = dict[str, Job]()
+        self.queues = {region: Queue[Job | None]() for region in regions}
+        self.accounts = {
+            region: AccountPool.from_config(cfg, username, password, region)
+            for region in regions}
+        # no more sessions than accounts,
+        # a second reader session on one gets ERROR998
+        self.sessions = [Session(f"serve-{region}-{i}", self, region,
+                                 self.queues[region])
+                         for region in regions
+                         for i in range(min(workers or len(self.accounts[region]),
+                                            len(self.accounts[region])))]
+        self.lock = threading.Lock()
+        self.startup_lock = threading.Lock()
+        self.draining = False
+        self.stopped = threading.Event()
+
+    def start(self):
+        for session in self.sessions:
+            session.start()
+
+    def submit(self, books: list[str], region: str | None = None,
+               overwrite: bool = False, verify: bool = False) -> list[Job]:
+        jobs = list[Job]()
+        for book_uuid, book_region, _ in resolve_books(books):
+            job_region = region or book_region or "jp"
+            if job_region not in self.queues or not self.available(job_region):
+                raise ValueError(f"No session for region {job_region}")
+            jobs.append(Job(book_uuid=book_uuid, region=job_region,
+                            overwrite=overwrite, verify=verify))
+        completed = set[str]() if overwrite or verify else \
+            Catalog.open().completed(job.book_uuid for job in jobs)
+        with self.lock:
+            if self.draining:
+                raise RuntimeError("Server is draining")
+            for job in jobs:
+                self.jobs[job.id] = job
+                if job.book_uuid in completed:
+                    job.state = "done"
+                    job.finished_at = time.time()
+                else:
+                    self.queues[job.region].put(job)
+        for job in jobs:
+            if job.state == "done":
+                logging.info("Book %s is already downloaded, job %s done",
+                             job.book_uuid, job.id)
+            else:
+                logging.info("Queued job %s for book %s", job.id, job.book_uuid)
+        return jobs
+
+    def available(self, region: str) -> bool:
+        return any(s.region == region and s.state != "failed" for s in self.sessions)
+
+    def begin(self, job: Job) -> bool:
+        with self.lock:
+            if job.state != "queued":
+                return False
+            job.state = "running"
+            job.started_at = time.time()
+            return True
+
+    def finish(self, job: Job, error: BaseException | None = None):
+        with self.lock:
+            job.state = "failed" if error else "done"
+            job.error = repr(error) if error else None
+            job.finished_at = time.time()
+        logging.info("Job %s %s", job.id, job.state)
+
+    def cancel(self, job_id: str) -> Job:
+        with self.lock:
+            job = self.jobs[job_id]
+            if job.state == "queued":
+                job.state = "cancelled"
+                job.finished_at = time.time()
+            return job
+
+    def session_failed(self, session: Session):
+        # nobody else is going to pick up this region's jobs
+        if self.available(session.region):
+            return
+        while not self.queues[session.region].empty():
+            job = self.queues[session.region].get_nowait()
+            if job is not None and self.begin(job):
+                self.finish(job, RuntimeError(
+                    f"No session for region {session.region}"))
+
+    def status(self) -> dict:
+        with self.lock:
+            states = [job.state for job in self.jobs.values()]
+        return {
+            "draining": self.draining,
+            "sessions": {s.name: s.state for s in self.sessions},
+            "jobs": {state: states.count(state) for state in set(states)},
+        }
+
+    def drain(self):
+        """
+        Stop taking jobs, let the queued ones finish, then stop
+        """
+        with self.lock:
+            if self.draining:
+                return
+            self.draining = True
+        logging.info("Draining, waiting for %s queued jobs",
+                     sum(q.qsize() for q in self.queues.values()))
+        for session in self.sessions:
+            self.queues[session.region].put(None)
+
+        def wait():
+            for session in self.sessions:
+                session.join()
+            self.stopped.set()
+        threading.Thread(target=wait, name="drain", daemon=True).start()
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: "HTTPServer | UnixHTTPServer"
+
+    def log_message(self, format, *args):
+        logging.debug("%s %s", self.command, format % args)
+
+    def reply(self, status: int, body, content_type: str = "application/json"):
+        data = (body if isinstance(body, str)
+                else json.dumps(body, ensure_ascii=False)).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def do_GET(self):
+        app = self.server.app
+        parts = self.path.strip("/").split("/")
+        match parts:
+            case ["status"]:
+                self.reply(200, app.status())
+            case ["metrics"]:
+                self.reply(200, registry.render(), "text/plain; version=0.0.4")
+            case ["jobs"]:
+                with app.lock:
+                    jobs = [j.model_dump() for j in app.jobs.values()]
+                self.reply(200, jobs)
+            case ["jobs", job_id] if job_id in app.jobs:
+                with app.lock:
+                    job = app.jobs[job_id].model_dump()
+                self.reply(200, job)
+            case _:
+                self.reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        app = self.server.app
+        match self.path.strip("/").split("/"):
+            case ["jobs"]:
+                try:
+                    body = self.read_json()
+                    jobs = app.submit(body["books"], body.get("region"),
+                                      bool(body.get("overwrite")),
+                                      bool(body.get("verify")))
+                except RuntimeError as e:
+                    self.reply(503, {"error": str(e)})
+                except (KeyError, ValueError, TypeError) as e:
+                    self.reply(400, {"error": str(e)})
+                else:
+                    self.reply(202, [j.model_dump() for j in jobs])
+            case ["drain"]:
+                app.drain()
+                self.reply(202, app.status())
+            case _:
+                self.reply(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        app = self.server.app
+        match self.path.strip("/").split("/"):
+            case ["jobs", job_id] if job_id in app.jobs:
+                self.reply(200, app.cancel(job_id).model_dump())
+            case _:
+                self.reply(404, {"error": "not found"})
+
+
+class HTTPServer(ThreadingHTTPServer):
+    app: Server
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+    app: Server
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("unix", 0)  # BaseHTTPRequestHandler expects a host and port
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: Path, timeout: float = 10):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(str(self.path))
+
+
+def load_config():
+    from . import Config
+    if not config_path.exists():
+        return Config()
+    cfg, _ = Config.from_dict(json.loads(config_path.read_text(encoding="utf-8")))
+    return cfg
+
+
+def add_address_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--host", help="Address of the HTTP API",
+                        default=DEFAULT_HOST)
+    parser.add_argument("--port", help="Port of the HTTP API", type=int,
+                        default=DEFAULT_PORT)
+    parser.add_argument("--socket",
+                        help="Use a Unix socket at this path instead of TCP",
+                        type=Path)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="bookphucker serve")
+    parser.add_argument("-r", "--regions", help="Sites to keep logged in sessions for",
+                        nargs='+', default=["jp"], choices=["jp", "tw"])
+    parser.add_argument("-w", "--workers",
+                        help="Browser sessions per region, defaults to one per account",
+                        type=int, default=0)
+    add_address_arguments(parser)
+    args = parser.parse_args(argv)
+
+    cfg = load_config()
+    cfg.config_logging()
+    from getpass import getpass
+    # the accounts in the config are enough, unless there is a main one too
+    prompt = not cfg.manual_login and bool(cfg.username or not cfg.accounts)
+    username = (cfg.username or input("Enter your username: ")) if prompt else ''
+    password = (cfg.password or getpass("Enter your password: ")) if prompt else ''
+    app = Server(cfg, username, password, args.regions, args.workers)
+
+    httpd: HTTPServer | UnixHTTPServer
+    if args.socket:
+        with suppress(FileNotFoundError):
+            args.socket.unlink()
+        httpd = UnixHTTPServer(str(args.socket), Handler)
+        os.chmod(args.socket, 0o600)
+        address = str(args.socket)
+    else:
+        httpd = HTTPServer((args.host, args.port), Handler)
+        address = f"http://{args.host}:{args.port}"
+    httpd.app = app
+
+    def on_signal(signum, frame):
+        signal.signal(signum, signal.SIG_DFL)  # a second signal stops right away
+        app.drain()
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    app.start()
+    threading.Thread(target=httpd.serve_forever, name="http", daemon=True).start()
+    logging.info("Serving on %s", address)
+    print(f"Serving on {address}", file=sys.stderr)
+    try:
+        with app.progress:
+            app.stopped.wait()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        if args.socket:
+            with suppress(FileNotFoundError):
+                args.socket.unlink()
+    failed = [j for j in app.jobs.values() if j.state == "failed"]
+    return 1 if failed else 0
+
+
+def request(args: argparse.Namespace, method: str, path: str, body=None):
+    conn = (UnixHTTPConnection(args.socket) if args.socket
+            else http.client.HTTPConnection(args.host, args.port, timeout=10))
+    try:
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        conn.request(method, path, data, {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        result = json.loads(response.read() or b"null")
+    finally:
+        conn.close()
+    if response.status >= 400:
+        raise SystemExit(f"{method} {path}: {result.get('error', response.status)}")
+    return result
+
+
+def submit_main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="bookphucker submit")
+    parser.add_argument("book_pages", help="The page url or book uuid", nargs='*')
+    parser.add_argument("-i", "--input",
+                        help="Read page urls or book uuids from a file, "
+                        "one per line ('-' for stdin)",
+                        action="append", default=[])
+    parser.add_argument("-r", "--region", help="The region of the bookwalker site",
+                        choices=["jp", "tw"])
+    parser.add_argument("--overwrite", help="Overwrite existing files",
+                        action="store_true")
+    parser.add_argument("--verify",
+                        help="Re-hash saved pages, fetch missing or changed ones again",
+                        action="store_true")
+    parser.add_argument("--wait", help="Wait for the jobs to finish",
+                        action="store_true")
+    add_address_arguments(parser)
+    args = parser.parse_args(argv)
+
+    books = args.book_pages + read_book_list(args.input)
+    if not books:
+        parser.error("no books given")
+    jobs = request(args, "POST", "/jobs", {"books": books, "region": args.region,
+                                           "overwrite": args.overwrite,
+                                           "verify": args.verify})
+    for job in jobs:
+        print(f"{job['id']} {job['book_uuid']} {job['state']}")
+    if not args.wait:
+        return 0
+    pending = {job["id"] for job in jobs}
+    failed = False
+    while pending:
+        time.sleep(1)
+        for job_id in list(pending):
+            job = request(args, "GET", f"/jobs/{job_id}")
+            if job["state"] in ("queued", "running"):
+                continue
+            pending.discard(job_id)
+            failed |= job["state"] != "done"
+            print(f"{job['id']} {job['book_uuid']} {job['state']}"
+                  + (f": {job['error']}" if job["error"] else ""))
+    return 1 if failed else 0
+
+
+def jobs_main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="bookphucker jobs")
+    parser.add_argument("job_ids",
+                        help="Jobs to show, defaults to the server status and all jobs",
+                        nargs='*')
+    parser.add_argument("--cancel",
+                        help="Cancel the given jobs if they have not started",
+                        action="store_true")
+    parser.add_argument("--drain", help="Finish the queued jobs and stop the server",
+                        action="store_true")
+    add_address_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.drain:
+        print(json.dumps(request(args, "POST", "/drain"), indent=2))
+        return 0
+    if not args.job_ids:
+        print(json.dumps(request(args, "GET", "/status"), indent=2))
+        jobs = request(args, "GET", "/jobs")
+    else:
+        jobs = [request(args, "DELETE" if args.cancel else "GET", f"/jobs/{job_id}")
+                for job_id in args.job_ids]
+    for job in jobs:
+        print(f"{job['id']} {job['region']} {job['book_uuid']} {job['state']}"
+              + (f": {job['error']}" if job["error"] else ""))
+    return 0
@@ -0,0 +1,202 @@
+import logging
+from types import ModuleType
+from pathlib import Path
+from contextlib import suppress
+from typing import Callable, Literal
+from rich.progress import Progress
+from selenium import webdriver
+from selenium.common.exceptions import (
+    InvalidSessionIdException, JavascriptException, NoSuchWindowException,
+    WebDriverException)
+from urllib3.exceptions import HTTPError
+from bookphucker import Config
+from .accounts import AccountPool, Lease
+from .commonvars import cookies_path
+from .exc import Error998, RequiresCapcha
+
+Failure = Literal["crash", "session", "error998", "timeout", "fatal"]
+
+# what chromedriver says when the renderer of the page died
+CRASH_MESSAGES = ("tab crashed", "page crash", "target crashed", "renderer")
+# and when the browser or chromedriver itself is gone
+SESSION_MESSAGES = ("chrome not reachable", "disconnected", "session deleted",
+                    "no such session", "not connected to devtools",
+                    "target window already closed")
+# and when the viewer went away under a script, e.g. replaced by the ERROR998 page
+UNLOADED_MESSAGES = ("document unloaded", "nfbr is not defined")
+
+
+def classify(error: Exception, driver: webdriver.Chrome | None) -> Failure:
+    """
+    What went wrong with a book download, and so how to recover from it
+    """
+    if isinstance(error, RequiresCapcha):
+        return "fatal"
+    if isinstance(error, Error998):
+        return "error998"
+    if isinstance(error, (InvalidSessionIdException, NoSuchWindowException,
+                          HTTPError, ConnectionError)):
+        return "session"
+    if isinstance(error, WebDriverException):
+        message = (error.msg or '').lower()
+        if any(m in message for m in CRASH_MESSAGES):
+            return "crash"
+        if any(m in message for m in SESSION_MESSAGES):
+            return "session"
+        if driver is not None:
+            try:
+                if "ERROR998" in driver.page_source.upper().replace(" ", ""):
+                    return "error998"
+            except (WebDriverException, HTTPError, ConnectionError):
+                return "session"
+        if (isinstance(error, JavascriptException)
+                and not any(m in message for m in UNLOADED_MESSAGES)):
+            # our scripts failing is a bug or a change of the site,
+            # retrying will not help
+            return "fatal"
+        # the viewer did not get anywhere, opening the book again may do
+        return "session" if driver is None else "timeout"
+    return "fatal"
+
+
+class Supervisor:
+    """
+    A browser session downloading books one after another. Failed downloads are
+    classified and retried up to `max_retries` times per book: crashed or lost
+    browsers are started again and logged in from the saved cookies, ERROR998 logs
+    in again, and a stuck viewer just opens the book again. Pages already saved
+    are in the book's manifest, so a retry continues from the page that failed,
+    unless the book is overwritten.
+    With `accounts`, the session leases an account when it starts, in its own profile,
+    and on ERROR998 rests it and starts again with another one.
+    """
+
+    def __init__(self, cfg: Config, site: ModuleType, username: str = '',
+                 password: str = '', cookies_file: Path = cookies_path,
+                 new_driver: Callable[[Path | None], webdriver.Chrome] | None = None,
+                 driver: webdriver.Chrome | None = None,
+                 max_retries: int = 3, name: str = "session",
+                 profile_dir: Path | None = None, accounts: AccountPool | None = None):
+        self.cfg = cfg
+        self.site = site
+        self.username = username
+        self.password = password
+        self.cookies_file = cookies_file
+        self.new_driver = new_driver or cfg.get_webdriver
+        self.driver = driver
+        self.max_retries = max_retries
+        self.name = name
+        self.profile_dir = profile_dir
+        self.accounts = accounts
+        self.lease: Lease | None = None
+
+    def start(self) -> webdriver.Chrome:
+        self.quit()
+        if self.accounts is not None:
+            self.use(self.accounts.lease())
+        self.driver = self.new_driver(self.profile_dir)
+        try:
+            self.site.login(self.driver, self.username, self.password,
+                            error_on_captcha=self.cfg.headless,
+                            cookies_file=self.cookies_file)
+        except Exception:
+            self.quit()
+            raise
+        return self.driver
+
+    def use(self, lease: Lease):
+        self.lease = lease
+        self.username, self.password = lease.account.username, lease.account.password
+        self.cookies_file, self.profile_dir = lease.cookies_file, lease.profile_dir
+        logging.info("%s: using account %s", self.name, lease.account.username)
+
+    def alive(self) -> bool:
+        if self.driver is None:
+            return False
+        try:
+            self.driver.window_handles
+        except (WebDriverException, HTTPError, ConnectionError):
+            return False
+        return True
+
+    def close_tabs(self):
+        """
+        The jp store opens the reader in a new tab, do not let them pile up
+        """
+        if self.driver is None:
+            return
+        handles = self.driver.window_handles
+        for handle in handles[1:]:
+            self.driver.switch_to.window(handle)
+            self.driver.close()
+        self.driver.switch_to.window(handles[0])
+
+    def recover(self, failure: Failure):
+        match failure:
+            case "crash" | "session":
+                logging.warning("%s: starting a new browser", self.name)
+                self.start()
+            case "error998" if self.accounts is not None and self.lease is not None:
+                logging.warning("%s: Error 998, switching accounts", self.name)
+                self.accounts.cool_down(self.lease)
+                self.start()
+            case "error998":
+                logging.warning("%s: Error 998, logging in again", self.name)
+                self.site.logout(self.driver, cookies_file=self.cookies_file)
+                self.site.login(self.driver, self.username, self.password,
+                                error_on_captcha=self.cfg.headless,
+                                cookies_file=self.cookies_file)
+            case "timeout":
+                if not self.alive():
+                    self.start()
+
+    def download(self, book_uuid: str, overwrite: bool = False, verify: bool = False,
+                 progress: Progress | None = None):
+        """
+        Download a book, raises what made the last attempt fail
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                if not self.alive():
+                    self.start()
+                self.site.download_book(self.driver, self.cfg, book_uuid, overwrite,
+                                        cookies_file=self.cookies_file,
+                                        progress=progress, verify=verify)
+                return
+            except Exception as e:
+                failure = classify(e, self.driver)
+                if failure == "fatal" or attempt == self.max_retries:
+                    self.dump_error(book_uuid)
+                    raise
+                logging.warning("%s: %s on book %s, retrying (%s/%s): %r", self.name,
+                                failure, book_uuid, attempt + 1, self.max_retries, e)
+                try:
+                    self.recover(failure)
+                except RequiresCapcha:
+                    raise
+                except Exception as error:
+                    # the next attempt starts from a new browser
+                    logging.warning("%s: could not recover: %r", self.name, error)
+                    self.quit()
+            finally:
+                with suppress(Exception):
+                    self.close_tabs()
+
+    def dump_error(self, book_uuid: str):
+        if self.driver is None:
+            return
+        # never in the way of the error being reported
+        with suppress(Exception):
+            Path(f"error-{book_uuid}.html").write_text(
+                self.driver.page_source, encoding="utf-8")
+            Path(f"error-{book_uuid}.png").write_bytes(
+                self.driver.get_screenshot_as_png())
+
+    def quit(self):
+        if self.driver is not None:
+            with suppress(Exception):
+                self.driver.quit()
+            self.driver = None
+        if self.lease is not None and self.accounts is not None:
+            self.accounts.release(self.lease)
+            self.lease = None
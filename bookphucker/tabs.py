@@ -0,0 +1,206 @@
+import logging
+from contextlib import suppress
+from itertools import zip_longest
+from urllib.parse import urlparse
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from .capture import (
+    MOVE_JS, Frame, Navigation, capture, fit_native_resolution, viewer_script)
+from .config import Config
+from .metrics import BookMetrics
+from .tuning import RenderTuner
+
+
+def rejected(driver: webdriver.Chrome) -> bool:
+    """
+    The site turned the viewer away, another one being open (ERROR998)
+    """
+    return "ERROR998" in driver.page_source.upper().replace(" ", "")
+
+
+def wait_reader(driver: webdriver.Chrome, timeout: float = 30):
+    WebDriverWait(driver, timeout).until(
+        EC.presence_of_element_located((By.CSS_SELECTOR, ".currentScreen canvas")))
+    WebDriverWait(driver, timeout).until(
+        EC.invisibility_of_element_located((By.CLASS_NAME, "progressbar")))
+
+
+class Tabs:
+    """
+    Viewers of one book in the same browser session, each owning a contiguous share
+    of its pages. WebDriver drives one of them at a time, so before a page is captured
+    the other viewers are started on their next page, and render meanwhile.
+    Extra viewers are opened as windows, which are not throttled like background tabs.
+    Viewers the site turns away are closed and their pages handed to the others,
+    later books on the same host then open no more viewers than were accepted.
+    """
+    limits = dict[str, int]()  # host -> viewers the site accepted at once
+
+    def __init__(self, driver: webdriver.Chrome, navigation: Navigation, cfg: Config,
+                 metrics: BookMetrics | None = None, tuner: RenderTuner | None = None):
+        self.driver = driver
+        self.navigation = navigation
+        self.cfg = cfg
+        self.fit = cfg.native_resolution
+        self.metrics = metrics
+        self.tuner = tuner
+        self.url = driver.current_url
+        self.host = urlparse(self.url).hostname or ''
+        self.count = max(1, min(cfg.tabs, self.limits.get(self.host, cfg.tabs)))
+        self.current = driver.current_window_handle
+        self.handles = [self.current]
+        self.owner = dict[int, str]()  # page -> handle
+        self.next = dict[int, int | None]()  # page -> following page of the same share
+        self.upcoming = dict[str, int]()  # handle -> page to start next
+        self.started = dict[str, int]()  # handle -> page being moved to
+
+    def __enter__(self) -> "Tabs":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def plan(self, pages: list[int]) -> list[int]:
+        """
+        Open the viewers for `pages` and split them into shares,
+        returns the pages in the order to capture them, taking turns between shares
+        """
+        self.open(min(self.count, len(pages)), len(pages))
+        n = len(self.handles)
+        shares = [pages[i * len(pages) // n:(i + 1) * len(pages) // n]
+                  for i in range(n)]
+        for handle, share in zip(self.handles, shares):
+            for page, following in zip_longest(share, share[1:]):
+                self.owner[page] = handle
+                self.next[page] = following
+            if share:
+                self.upcoming[handle] = share[0]
+        if n > 1:
+            logging.info("Capturing with %s viewers", n)
+        return [page for turn in zip_longest(*shares) for page in turn
+                if page is not None]
+
+    def open(self, count: int, total: int):
+        while len(self.handles) < count:
+            self.driver.switch_to.new_window("window")
+            handle = self.current = self.driver.current_window_handle
+            try:
+                self.driver.get(self.url)
+                wait_reader(self.driver)
+                accepted = not rejected(self.driver)
+            except TimeoutException:
+                accepted = False
+            first_rejected = False
+            if accepted:
+                # opening another viewer may just as well turn the first one away
+                self.switch(self.handles[0])
+                first_rejected = rejected(self.driver)
+            if not accepted or first_rejected:
+                self.switch(handle)
+                self.driver.close()
+                self.current = ''
+                self.limits[self.host] = len(self.handles)
+                logging.warning("The site does not accept %s viewers at once, using %s",
+                                len(self.handles) + 1, len(self.handles))
+                self.switch(self.handles[0])
+                if first_rejected:
+                    self.driver.refresh()
+                    wait_reader(self.driver)
+                    if self.fit:
+                        fit_native_resolution(self.driver, total, self.navigation)
+                break
+            self.handles.append(handle)
+            if self.fit:
+                self.switch(handle)
+                fit_native_resolution(self.driver, total, self.navigation)
+        if self.metrics is not None:
+            self.metrics.count("viewers", len(self.handles))
+        self.switch(self.handles[0])
+
+    def switch(self, handle: str):
+        if handle != self.current:
+            self.driver.switch_to.window(handle)
+            self.current = handle
+
+    def prefetch(self, busy: str):
+        """
+        Start every viewer but `busy` moving to its next page
+        """
+        for handle in self.handles:
+            page = self.upcoming.get(handle)
+            if handle == busy or page is None or self.started.get(handle) == page:
+                continue
+            self.started[handle] = page
+            try:
+                self.switch(handle)
+                self.driver.execute_script(viewer_script(MOVE_JS, self.navigation),
+                                           page - 1)
+            except WebDriverException as e:
+                # the capture on this viewer will find out what is wrong
+                logging.debug("Could not start page %s: %r", page, e)
+
+    def grab(self, page: int, retry: bool, final: bool = False) -> Frame:
+        handle = self.owner.get(page, self.handles[0])
+        self.started.pop(handle, None)
+        self.upcoming[handle] = page
+        self.prefetch(handle)
+        self.switch(handle)
+        try:
+            frame = capture(self.driver, page - 1, self.navigation,
+                            redraw=1 if retry else 0, metrics=self.metrics,
+                            tuner=self.tuner,
+                            transport=self.cfg.transport, precheck=self.cfg.precheck,
+                            force=final)
+        except WebDriverException:
+            # turned away mid capture, the script times out or fails with the page
+            turned_away = False
+            with suppress(WebDriverException):
+                turned_away = len(self.handles) > 1 and rejected(self.driver)
+            if not turned_away:
+                raise
+            self.drop(handle)
+            return self.grab(page, retry, final)
+        following = self.next.get(page)
+        if following is not None and self.owner.get(following) == handle:
+            self.upcoming[handle] = following
+        else:
+            self.upcoming.pop(handle, None)
+        return frame
+
+    def drop(self, handle: str):
+        """
+        Close a viewer the site turned away and hand its pages to the others
+        """
+        self.handles.remove(handle)
+        self.limits[self.host] = len(self.handles)
+        logging.warning("The site turned a viewer away, going on with %s",
+                        len(self.handles))
+        if self.metrics is not None:
+            self.metrics.count("dropped_viewers")
+        with_pages = [page for page, owner in self.owner.items() if owner == handle]
+        for i, page in enumerate(with_pages):
+            self.owner[page] = self.handles[i % len(self.handles)]
+        self.upcoming.pop(handle, None)
+        self.started.pop(handle, None)
+        self.switch(handle)
+        self.driver.close()
+        self.current = ''
+        self.switch(self.handles[0])
+
+    def close(self):
+        """
+        Close the viewers opened for this book, the first one is left as it was
+        """
+        for handle in self.handles[1:]:
+            try:
+                self.switch(handle)
+                self.driver.close()
+            except WebDriverException as e:
+                logging.debug("Could not close a viewer: %r", e)
+            self.current = ''
+        del self.handles[1:]
+        with suppress(WebDriverException):
+            self.switch(self.handles[0])
@@ -0,0 +1,97 @@
+import logging
+import threading
+import ujson as json
+from collections import deque
+from pathlib import Path
+from typing import Iterable
+from .commonvars import cache_path
+from .metrics import percentile
+from .utils import write_atomic
+
+latency_path = cache_path / "latency.json"
+
+
+def clamp(value: float, low: float, high: float) -> float:
+    return max(low, min(high, value))
+
+
+class RenderTuner:
+    """
+    Render latency of recent pages, seeded with what was seen on the same host before,
+    from which capture timeouts, redraw waits and polling intervals are derived.
+    Until enough pages were seen, the fixed defaults are used.
+    """
+    min_samples = 8
+    # what is kept per host between books
+    history = 256
+    _lock = threading.Lock()
+
+    def __init__(self, host: str, samples: Iterable[float] = (), window: int = 64,
+                 max_timeout: float = 30, path: Path = latency_path):
+        self.host = host
+        self.path = path
+        self.max_timeout = max_timeout
+        self.recent = deque[float](samples, maxlen=window)
+        self.seen = list[float]()  # this book only, saved to the host history
+
+    @classmethod
+    def load(cls, host: str, path: Path = latency_path, **kwargs) -> "RenderTuner":
+        history = dict[str, list[float]]()
+        with cls._lock:
+            if path.exists():
+                try:
+                    history = json.loads(path.read_text(encoding="utf-8"))
+                except ValueError:
+                    logging.warning("Ignoring broken latency history %s", path)
+        return cls(host, history.get(host, []), path=path, **kwargs)
+
+    def save(self):
+        """
+        Merge the latencies of this book into the host history
+        """
+        if not self.seen:
+            return
+        with self._lock:
+            history = dict[str, list[float]]()
+            if self.path.exists():
+                try:
+                    history = json.loads(self.path.read_text(encoding="utf-8"))
+                except ValueError:
+                    pass
+            seen = history.get(self.host, []) + self.seen
+            history[self.host] = seen[-self.history:]
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(self.path, json.dumps(history).encode("utf-8"))
+        self.seen.clear()
+
+    def observe(self, seconds: float):
+        self.recent.append(seconds)
+        self.seen.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        if len(self.recent) < self.min_samples:
+            return None
+        return percentile(sorted(self.recent), q)
+
+    def timeout(self) -> float:
+        """
+        How long a page may take before it is flagged as slow
+        """
+        p99 = self.percentile(0.99)
+        if p99 is None:
+            return self.max_timeout
+        return clamp(p99 * 4 + 1, 3, self.max_timeout)
+
+    def redraw(self) -> float:
+        """
+        How long to wait for the viewer to draw a retried page again
+        """
+        p95 = self.percentile(0.95)
+        return 1 if p95 is None else clamp(p95 * 2, 0.05, 5)
+
+    def interval(self) -> float:
+        """
+        Polling interval of the in-page safety net, for changes no hook sees
+        """
+        p50 = self.percentile(0.5)
+        return 0.25 if p50 is None else clamp(p50 / 4, 0.02, 0.25)
@@ -1,38 +1,71 @@
-import ujson as json
-from typing import Any
+import os
+import time
+from tempfile import NamedTemporaryFile
+from typing import Callable, Iterator, TypeVar
+from contextlib import contextmanager
+from functools import cache
+from pathlib import Path
+from rich.progress import Progress
 from selenium import webdriver
-from urllib.parse import urlparse
 from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from .commonvars import cookies_path
-
-
-def recover_cookies(driver: webdriver.Chrome, url: str) -> bool:
-    if not cookies_path.exists():
-        return False
-    all_cookies: dict[str, list[dict[str, Any]]] = json.loads(cookies_path.read_text())
-    netloc = urlparse(url).netloc
-    if netloc not in all_cookies:
-        return False
-    driver.get(url)
-    driver.delete_all_cookies()
-    cookies = all_cookies[netloc]
-    for cookie in cookies:
-        driver.add_cookie(cookie)
-    return True
-
-
-def save_cookies(driver: webdriver.Chrome, url: str):
-    driver.get(url)
-    cookies = driver.get_cookies()
-    if not cookies_path.exists():
-        all_cookies = {}
-    else:
-        all_cookies = json.loads(cookies_path.read_text())
-    netloc = urlparse(url).netloc
-    all_cookies[netloc] = cookies
-    cookies_path.write_text(json.dumps(all_cookies, indent=2), encoding = "utf-8")
+from selenium.common.exceptions import TimeoutException
+
+T = TypeVar("T")
+
+
+@cache
+def file_mode() -> int:
+    """
+    What a plain open() gives new files, temporary files are created 0600.
+    The umask can only be read by setting it, so this is done once on first use
+    """
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def poll(func: Callable[[], T], timeout: float = 10, interval: float = 0.05,
+         max_interval: float = 1, backoff: float = 1.5,
+         ignored: tuple[type[Exception], ...] = (),
+         message: str = "Polling timeout") -> T:
+    """
+    Call `func` until it returns something truthy, sleeping between attempts
+    with exponential backoff, `ignored` exceptions count as a falsy result
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            result = func()
+            if result:
+                return result
+        except ignored:
+            pass
+        now = time.monotonic()
+        if now >= deadline:
+            raise TimeoutException(message)
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * backoff, max_interval)
+
+
+def write_atomic(path: Path, data: bytes):
+    """
+    Write through a temporary file in the same directory then rename,
+    so readers never see a partially written file
+    """
+    with NamedTemporaryFile(dir=path.parent, prefix=f".{path.name}.",
+                            delete=False) as f:
+        try:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            os.chmod(f.name, file_mode())
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, path)
 
 
 def scroll_click(driver: webdriver.Chrome, element: WebElement, timeout: int = 10):
@@ -44,3 +77,23 @@ def scroll_click(driver: webdriver.Chrome, element: WebElement, timeout: int = 1
 def find_click(driver: webdriver.Chrome, by: str, value: str, timeout: int = 10):
     element = driver.find_element(by, value)
     scroll_click(driver, element, timeout)
+
+
+@contextmanager
+def page_progress(total: int, description: str = "Downloading",
+                  progress: Progress | None = None) -> Iterator[Callable[[], None]]:
+    """
+    Yield a callback advancing a progress bar by one page,
+    reports to a shared `Progress` when given so several workers
+    can render their own bars in one live display
+    """
+    if progress is None:
+        with Progress() as own:
+            task = own.add_task(description, total=total)
+            yield lambda: own.advance(task)
+        return
+    task = progress.add_task(description, total=total)
+    try:
+        yield lambda: progress.advance(task)
+    finally:
+        progress.remove_task(task)
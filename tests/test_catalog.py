@@ -0,0 +1,58 @@
+import ujson as json
+from bookphucker.catalog import Catalog, LEGACY
+
+
+def test_add(tmp_path):
+    catalog = Catalog(tmp_path / "catalog.sqlite3")
+    save_dir = catalog.add("u-1", "jp", "Title", ["Author"], tmp_path)
+    assert save_dir == tmp_path / "Title"
+    meta = json.loads((save_dir / "meta.json").read_text(encoding="utf-8"))
+    assert meta == {"title": "Title", "authors": ["Author"], "uuid": "u-1",
+                    "region": "jp"}
+    # opened again, the book keeps its directory
+    assert catalog.add("u-1", "jp", "Title", ["Author"], tmp_path) == save_dir
+    entry = catalog.get("u-1")
+    assert entry is not None and entry.state == "partial"
+
+
+def test_title_collision(tmp_path):
+    catalog = Catalog(tmp_path / "catalog.sqlite3")
+    catalog.add("u-1", "jp", "Title", ["Author"], tmp_path)
+    assert catalog.add("u-2", "jp", "Title", ["Other"], tmp_path) == (
+        tmp_path / "Title [u-2]")
+    # a directory of a book the catalog has not seen
+    (tmp_path / "Other").mkdir()
+    (tmp_path / "Other" / "meta.json").write_text(json.dumps(
+        {"title": "Other", "authors": [], "uuid": "u-3"}), encoding="utf-8")
+    assert catalog.add("u-4", "tw", "Other", [], tmp_path) == tmp_path / "Other [u-4]"
+
+
+def test_completed(tmp_path):
+    catalog = Catalog(tmp_path / "catalog.sqlite3")
+    for book_uuid in ("u-1", "u-2", "u-3"):
+        catalog.add(book_uuid, "jp", book_uuid, [], tmp_path)
+    catalog.update("u-1", pages=10, saved=10)
+    catalog.update("u-2", pages=10, saved=9)
+    catalog.update("u-3", pages=10, saved=10)
+    (tmp_path / "u-3" / "meta.json").unlink()
+    (tmp_path / "u-3").rmdir()
+    assert catalog.completed(["u-1", "u-2", "u-3", "u-4"]) == {"u-1"}
+    entry = catalog.get("u-2")
+    assert entry is not None and (entry.pages, entry.saved) == (10, 9)
+
+
+def test_adopt(tmp_path):
+    for name, meta in (("Book", {"title": "Book", "authors": ["A"], "uuid": "u-1"}),
+                       ("Old", {"title": "Old", "authors": ["B"]})):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    catalog = Catalog(tmp_path / "catalog.sqlite3")
+    entry = catalog.get("u-1")
+    assert entry is not None and entry.path == str(tmp_path / "Book")
+    assert catalog.get(LEGACY + "Old") is not None
+    # the book downloaded before UUIDs were recorded gets its directory back
+    assert catalog.add("u-2", "jp", "Old", ["B"], tmp_path) == tmp_path / "Old"
+    assert catalog.get(LEGACY + "Old") is None
+    # another book of the same title does not
+    assert catalog.add("u-3", "jp", "Book", ["C"], tmp_path) == (
+        tmp_path / "Book [u-3]")
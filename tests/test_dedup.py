@@ -0,0 +1,45 @@
+from bookphucker.dedup import PageIndex
+
+
+def test_find_identical():
+    index = PageIndex()
+    index.add(1, "a", 0b1111)
+    assert index.find(2, "a", 0) == 1
+    # a page does not repeat itself
+    assert index.find(1, "a", 0b1111) is None
+
+
+def test_find_near_duplicate():
+    index = PageIndex(max_distance=2)
+    index.add(1, "a", 0b1111)
+    assert index.find(2, "b", 0b0111) == 1
+    assert index.find(2, "b", 0b0000) is None
+
+
+def test_uniform_pages():
+    index = PageIndex()
+    index.add(1, "a", None)
+    assert index.find(2, "a", None) is None
+    assert index.find(2, "b", 0) is None
+
+
+def test_recent_only():
+    # sparse pages far apart in the book may hash alike, only stale buffers count
+    index = PageIndex(max_distance=2, recent=2)
+    for page in (1, 2, 3):
+        index.add(page, f"d{page}", 0xff << page * 8)
+    assert index.find(4, "x", 0xff << 8) is None
+    assert index.find(4, "x", 0xff << 24) == 3
+    # further back identical content still counts
+    assert index.find(4, "d1", 0) == 1
+
+
+def test_replace_and_remove():
+    index = PageIndex()
+    index.add(1, "a", 0b1111)
+    index.add(1, "b", 0b1111 << 16)
+    assert index.find(2, "a", 0b1111 << 32) is None
+    assert index.find(2, "b", 0) == 1
+    index.remove(1)
+    assert index.find(2, "b", 0b1111 << 16) is None
+    assert not index.recent
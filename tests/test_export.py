@@ -0,0 +1,68 @@
+import hashlib
+import ujson as json
+from zipfile import ZipFile, ZIP_STORED
+from bookphucker.export import export_book
+from bookphucker.manifest import Manifest, PageEntry
+from tests.test_imaging import page
+
+
+def make_book(book_dir, pages: int = 3):
+    book_dir.mkdir()
+    (book_dir / "meta.json").write_text(json.dumps(
+        {"title": "A & B", "authors": ["Author"], "uuid": "u-1", "region": "jp"}),
+        encoding="utf-8")
+    with Manifest.load(book_dir) as manifest:
+        for n in range(1, pages + 1):
+            path = book_dir / f"page_{n}.png"
+            page(n).save(path)
+            data = path.read_bytes()
+            manifest.append(PageEntry(page=n, file=path.name,
+                                      sha1=hashlib.sha1(data).hexdigest(),
+                                      size=len(data), width=320, height=480,
+                                      captured_at=n, bad=n == pages))
+
+
+def test_cbz(tmp_path):
+    make_book(tmp_path / "book")
+    out = export_book(tmp_path / "book", "cbz", tmp_path / "out")
+    assert out == tmp_path / "out" / "book.cbz"
+    with ZipFile(out) as zf:
+        # bad pages are left out
+        assert zf.namelist() == ["ComicInfo.xml", "1.png", "2.png"]
+        assert zf.getinfo("1.png").compress_type == ZIP_STORED
+        assert zf.read("2.png") == (tmp_path / "book" / "page_2.png").read_bytes()
+        info = zf.read("ComicInfo.xml").decode()
+    assert "<Title>A &amp; B</Title>" in info
+    assert "YesAndRightToLeft" in info
+
+
+def test_epub(tmp_path):
+    make_book(tmp_path / "book")
+    out = export_book(tmp_path / "book", "epub", direction="ltr")
+    assert out == tmp_path / "book.epub"
+    with ZipFile(out) as zf:
+        names = zf.namelist()
+        assert names[0] == "mimetype"
+        assert zf.getinfo("mimetype").compress_type == ZIP_STORED
+        assert zf.read("mimetype") == b"application/epub+zip"
+        assert {"OEBPS/images/p1.png", "OEBPS/p2.xhtml",
+                "OEBPS/nav.xhtml"} <= set(names)
+        assert "OEBPS/images/p3.png" not in names
+        opf = zf.read("OEBPS/content.opf").decode()
+    assert '<dc:identifier id="uid">u-1</dc:identifier>' in opf
+    assert "<dc:language>ja</dc:language>" in opf
+    assert 'page-progression-direction="ltr"' in opf
+
+
+def test_up_to_date(tmp_path):
+    make_book(tmp_path / "book")
+    out = export_book(tmp_path / "book", "cbz")
+    mtime = out.stat().st_mtime_ns
+    assert export_book(tmp_path / "book", "cbz") == out
+    assert out.stat().st_mtime_ns == mtime
+    # a page saved again changes the digest
+    with Manifest.load(tmp_path / "book") as manifest:
+        entry = manifest.pages[1].model_copy(update={"sha1": "0" * 40})
+        manifest.append(entry)
+    export_book(tmp_path / "book", "cbz")
+    assert out.stat().st_mtime_ns != mtime
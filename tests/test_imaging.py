@@ -0,0 +1,41 @@
+import random
+from PIL import Image, ImageDraw
+from bookphucker.imaging import looks_unloaded, dhash
+
+
+def page(seed: int = 0, size: tuple[int, int] = (320, 480)) -> Image.Image:
+    rng = random.Random(seed)
+    img = Image.new("RGBA", size, (255, 255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randrange(size[0] - 80), rng.randrange(size[1] - 80)
+        draw.rectangle((x, y, x + rng.randrange(20, 80), y + rng.randrange(20, 80)),
+                       fill=(0, 0, 0, 255))
+    return img
+
+
+def test_looks_unloaded():
+    assert looks_unloaded(Image.new("RGBA", (640, 640)))
+    assert not looks_unloaded(page())
+    # a few stray pixels on an empty canvas are not a page yet
+    img = Image.new("RGBA", (640, 640))
+    img.putpixel((10, 10), (0, 0, 0, 255))
+    assert looks_unloaded(img)
+
+
+def test_looks_unloaded_without_alpha():
+    black = Image.new("RGB", (640, 640))
+    assert looks_unloaded(black)
+    # WebP drops the alpha of an opaque canvas, so it was drawn on
+    assert not looks_unloaded(black, luminance=False)
+
+
+def test_dhash():
+    assert dhash(Image.new("RGB", (320, 480), (255, 255, 255))) is None
+    a, b = dhash(page(1)), dhash(page(2))
+    assert a is not None and b is not None
+    assert dhash(page(1)) == a
+    assert (a ^ b).bit_count() > 4
+    # the same page drawn at another size hashes alike
+    resized = dhash(page(1).resize((640, 960), Image.Resampling.BILINEAR))
+    assert resized is not None and (a ^ resized).bit_count() <= 4
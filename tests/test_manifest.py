@@ -0,0 +1,78 @@
+import os
+import hashlib
+from PIL import Image
+from bookphucker.manifest import Manifest, PageEntry
+from tests.test_imaging import page
+
+
+def entry(n: int, data: bytes = b"", bad: bool = False) -> PageEntry:
+    sha1 = hashlib.sha1(data).hexdigest()
+    return PageEntry(page=n, file=f"page_{n}.png", sha1=sha1, size=len(data),
+                     width=1, height=1, captured_at=n, phash=sha1[:16], bad=bad)
+
+
+def test_append_and_load(tmp_path):
+    with Manifest.load(tmp_path) as manifest:
+        manifest.append(entry(1, b"one"))
+        manifest.append(entry(2, b"two", bad=True))
+        manifest.append(entry(2, b"two again"))
+        manifest.append(entry(3, b"three", bad=True))
+    loaded = Manifest.load(tmp_path)
+    assert sorted(loaded.pages) == [1, 2, 3]
+    # the last line of a page wins
+    assert loaded.pages[2].size == len(b"two again")
+    assert [loaded.done(n) for n in (1, 2, 3, 4)] == [True, True, False, False]
+
+
+def test_load_torn_line(tmp_path):
+    with Manifest.load(tmp_path) as manifest:
+        manifest.append(entry(1, b"one"))
+    with manifest.path.open("a", encoding="utf-8") as f:
+        f.write('{"page": 2, "fi')
+    assert sorted(Manifest.load(tmp_path).pages) == [1]
+
+
+def test_verify(tmp_path):
+    (tmp_path / "page_1.png").write_bytes(b"one")
+    (tmp_path / "page_2.png").write_bytes(b"changed")
+    with Manifest.load(tmp_path) as manifest:
+        for n, data in ((1, b"one"), (2, b"two"), (3, b"missing")):
+            manifest.append(entry(n, data))
+    assert manifest.verify(workers=2) == [2, 3]
+    loaded = Manifest.load(tmp_path)
+    assert [loaded.done(n) for n in (1, 2, 3)] == [True, False, False]
+
+
+def test_adopt(tmp_path):
+    page(1).save(tmp_path / "page_1.png")
+    page(2).save(tmp_path / "page_2.png")
+    Image.new("RGBA", (320, 480)).save(tmp_path / "page_3.png")
+    (tmp_path / "page_4.png").write_bytes(b"torn")
+    manifest = Manifest.load(tmp_path)
+    assert sorted(manifest.pages) == [1, 2]
+    data = (tmp_path / "page_1.png").read_bytes()
+    assert manifest.pages[1].sha1 == hashlib.sha1(data).hexdigest()
+    assert manifest.pages[1].phash is not None
+    assert manifest.path.exists()
+
+
+def test_adopt_webp(tmp_path):
+    page(1).save(tmp_path / "page_1.webp", lossless=True)
+    page(2).save(tmp_path / "page_2.png")
+    page(2).save(tmp_path / "page_2.webp", lossless=True)
+    os.utime(tmp_path / "page_2.png", (0, 0))
+    manifest = Manifest.load(tmp_path)
+    # the newer of a page saved with two transports
+    assert {n: e.file for n, e in manifest.pages.items()} == {
+        1: "page_1.webp", 2: "page_2.webp"}
+
+
+def test_index(tmp_path):
+    with Manifest.load(tmp_path) as manifest:
+        manifest.append(entry(1, b"one"))
+        manifest.append(entry(2, b"two", bad=True))
+    index = manifest.index()
+    one, two = manifest.pages[1], manifest.pages[2]
+    assert index.find(3, one.sha1, 0) == 1
+    # bad pages are fetched again, they are not worth comparing against
+    assert index.find(3, two.sha1, int(str(two.phash), 16)) is None
@@ -0,0 +1,50 @@
+import hashlib
+import ujson as json
+from bookphucker.manifest import Manifest, PageEntry
+from bookphucker.ocr import connect, pending_pages, store_page, search
+
+
+def make_book(book_dir, uuid: str | None = "u-1"):
+    book_dir.mkdir()
+    meta = {"title": "Title", "authors": []}
+    if uuid:
+        meta["uuid"] = uuid
+    (book_dir / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    with Manifest.load(book_dir) as manifest:
+        for n in (1, 2):
+            manifest.append(PageEntry(page=n, file=f"page_{n}.png",
+                                      sha1=hashlib.sha1(bytes([n])).hexdigest(),
+                                      size=1, width=1, height=1, captured_at=n))
+
+
+def test_pending_pages(tmp_path):
+    make_book(tmp_path / "book")
+    db = connect(tmp_path / "ocr.sqlite3")
+    key, meta, todo = pending_pages(db, tmp_path / "book")
+    assert key == "u-1" and meta["title"] == "Title"
+    assert [page for page, _, _ in todo] == [1, 2]
+    store_page(db, key, 1, todo[0][1], "text")
+    assert [page for page, _, _ in pending_pages(db, tmp_path / "book")[2]] == [2]
+    assert len(pending_pages(db, tmp_path / "book", force=True)[2]) == 2
+    # books from before UUIDs were recorded are keyed by directory
+    make_book(tmp_path / "legacy", uuid=None)
+    assert pending_pages(db, tmp_path / "legacy")[0] == "legacy"
+
+
+def test_search(tmp_path):
+    db_path = tmp_path / "ocr.sqlite3"
+    db = connect(db_path)
+    db.execute("INSERT INTO books (book_uuid, title, path) VALUES ('u-1', 'Title', '')")
+    store_page(db, "u-1", 1, "a", "吾輩は猫である。名前はまだ無い。")
+    store_page(db, "u-1", 2, "b", "どこで生れたかとんと見当がつかぬ。")
+    db.commit()
+    assert search("名前はまだ", db_path=db_path) == [
+        ("u-1", "Title", 1, "吾輩は猫である。[名前はまだ]無い。")]
+    # shorter than a trigram
+    assert [row[2] for row in search("猫", db_path=db_path)] == [1]
+    # a page read again replaces its text
+    store_page(db, "u-1", 1, "c", "別の文章")
+    db.commit()
+    assert search("名前はまだ", db_path=db_path) == []
+    assert search("別の", db_path=db_path)[0][3] == "[別の]文章"
+    db.close()
@@ -0,0 +1,64 @@
+import io
+from base64 import b64encode
+from PIL import Image
+from bookphucker.capture import Frame
+from bookphucker.manifest import Manifest
+from bookphucker.metrics import BookMetrics
+from bookphucker.pipeline import capture_pages
+from tests.test_imaging import page
+
+# capture_pages is fed canned frames by a stub grab, without a browser;
+# the viewer side runs against benchmarks/fake_viewer.py by hand
+
+
+def frame(img: Image.Image) -> Frame:
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return Frame([b64encode(buf.getvalue()).decode("ascii")], "png", img.width,
+                 img.height)
+
+
+def test_capture_pages(tmp_path):
+    blank = frame(Image.new("RGBA", (320, 480)))
+    pages = {n: frame(page(n)) for n in (1, 2, 3)}
+    shown = {1: [blank, pages[1]], 2: [pages[1], pages[2]], 3: [pages[3]]}
+
+    def grab(n: int, retry: bool, final: bool) -> Frame:
+        # a blank canvas, then a stale buffer, before the page is drawn
+        return shown[n].pop(0) if len(shown[n]) > 1 else shown[n][0]
+
+    metrics = BookMetrics("u-1", "jp")
+    assert capture_pages(grab, [1, 2, 3], tmp_path, workers=1, max_pending=1,
+                         metrics=metrics) == 3
+    assert metrics.counters["blank_frames"] == 1
+    assert metrics.counters["stale_frames"] == 1
+    assert sorted(Manifest.load(tmp_path).pages) == [1, 2, 3]
+
+    # resumed, nothing is captured again
+    def fail(n: int, retry: bool, final: bool) -> Frame:
+        raise AssertionError(n)
+
+    assert capture_pages(fail, [1, 2, 3], tmp_path) == 3
+
+
+def test_other_transport(tmp_path):
+    img = page(1)
+    buf = io.BytesIO()
+    img.save(buf, "WEBP", lossless=True)
+    webp = Frame([b64encode(buf.getvalue()).decode("ascii")], "webp", img.width,
+                 img.height)
+    assert capture_pages(lambda n, retry, final: frame(img), [1], tmp_path) == 1
+    # saved again with another transport, the old file goes
+    assert capture_pages(lambda n, retry, final: webp, [1], tmp_path,
+                         overwrite=True) == 1
+    assert sorted(p.name for p in tmp_path.glob("page_*")) == ["page_1.webp"]
+    assert Manifest.load(tmp_path).pages[1].file == "page_1.webp"
+
+
+def test_forced_pages_are_bad(tmp_path):
+    blank = frame(Image.new("RGBA", (320, 480)))
+    assert capture_pages(lambda n, retry, final: blank, [1], tmp_path,
+                         max_retries=2) == 0
+    entry = Manifest.load(tmp_path).pages[1]
+    assert entry.bad
+    assert (tmp_path / entry.file).exists()
@@ -0,0 +1,89 @@
+import pytest
+from PIL import Image, ImageDraw
+from bookphucker import process
+from bookphucker.manifest import Manifest
+from bookphucker.process import (Options, find_gutter, trim, optimize, process_page,
+                                 process_books, load_index)
+
+
+def spread(left: int, right: int, size: tuple[int, int] = (800, 500)) -> Image.Image:
+    """
+    White spread with text on both sides of a blank gutter from `left` to `right`
+    """
+    w, h = size
+    img = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for y in range(40, h - 40, 20):
+        draw.rectangle((40, y, left - 1, y + 8), fill=(0, 0, 0))
+        draw.rectangle((right, y, w - 41, y + 8), fill=(0, 0, 0))
+    return img
+
+
+def test_find_gutter():
+    assert find_gutter(spread(380, 420), 16) in (399, 400)
+    # the centre of the blank run, not its edge
+    assert find_gutter(spread(340, 380), 16) in (359, 360)
+
+
+def test_find_gutter_art_across():
+    img = Image.new("RGB", (800, 500), (255, 255, 255))
+    ImageDraw.Draw(img).rectangle((100, 100, 700, 400), fill=(0, 0, 0))
+    assert find_gutter(img, 16) == 400
+
+
+def test_trim():
+    img = Image.new("RGB", (300, 200), (255, 255, 255))
+    ImageDraw.Draw(img).rectangle((50, 40, 149, 139), fill=(0, 0, 0))
+    assert trim(img, 16).size == (100, 100)
+    # nothing to trim on a blank page
+    blank = Image.new("RGB", (300, 200), (255, 255, 255))
+    assert trim(blank, 16).size == (300, 200)
+
+
+def test_optimize():
+    assert optimize(Image.new("RGBA", (4, 4), (10, 10, 10, 255))).mode == "L"
+    assert optimize(Image.new("RGBA", (4, 4), (10, 20, 30, 255))).mode == "RGB"
+    assert optimize(Image.new("RGBA", (4, 4), (10, 10, 10, 128))).mode == "RGBA"
+
+
+def test_process_page(tmp_path):
+    src = tmp_path / "page_1.png"
+    spread(380, 420).save(src)
+    outputs = process_page(str(src), str(tmp_path), "0001", Options(format="png"))
+    # right to left, the right page comes first
+    assert [o.file for o in outputs] == ["0001a.png", "0001b.png"]
+    for output in outputs:
+        with Image.open(tmp_path / output.file) as img:
+            assert img.size == (output.width, output.height)
+            assert img.mode == "L"
+        assert output.width < 400
+    ltr = Options(format="png", direction="ltr", split=False)
+    assert [o.file for o in process_page(str(src), str(tmp_path), "0002", ltr)] == [
+        "0002.png"]
+
+
+def test_process_books_failed_page(tmp_path):
+    spread(380, 420).save(tmp_path / "page_1.png")
+    spread(380, 420).save(tmp_path / "page_2.png")
+    Manifest.load(tmp_path)
+    (tmp_path / "page_2.png").write_bytes(b"torn")
+    options = Options(format="png")
+    process_books([tmp_path], options, workers=1)
+    assert sorted(load_index(tmp_path / process.processed_dirname, options)) == [1]
+
+
+def test_process_books_interrupted(tmp_path, monkeypatch):
+    spread(380, 420).save(tmp_path / "page_1.png")
+    Manifest.load(tmp_path)
+    options = Options(format="png")
+
+    def process_jobs(jobs, indexes, *args):
+        for book_dir, page, sha1, src in jobs:
+            indexes[book_dir][page] = process.Processed(sha1=sha1, outputs=[])
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(process, "process_jobs", process_jobs)
+    with pytest.raises(KeyboardInterrupt):
+        process_books([tmp_path], options)
+    # the pages done before the interruption are not processed again
+    assert sorted(load_index(tmp_path / process.processed_dirname, options)) == [1]
@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+from selenium.common.exceptions import (
+    JavascriptException, NoSuchWindowException, TimeoutException, WebDriverException)
+from bookphucker.exc import Error998, RequiresCapcha
+from bookphucker.supervisor import classify
+
+
+def driver(page_source: str = "<html></html>"):
+    return SimpleNamespace(page_source=page_source)
+
+
+def test_classify():
+    assert classify(RequiresCapcha(), driver()) == "fatal"
+    assert classify(Error998(), driver()) == "error998"
+    assert classify(NoSuchWindowException(), driver()) == "session"
+    assert classify(WebDriverException("tab crashed"), driver()) == "crash"
+    assert classify(WebDriverException("chrome not reachable"), driver()) == "session"
+    assert classify(TimeoutException(), driver()) == "timeout"
+    assert classify(TimeoutException(), driver("<p>ERROR 998</p>")) == "error998"
+    assert classify(ValueError(), driver()) == "fatal"
+
+
+def test_classify_script_errors():
+    # a bug of ours, or a change of the site
+    error = JavascriptException("Capture failed on page 3: TypeError: x is undefined")
+    assert classify(error, driver()) == "fatal"
+    # the viewer going away under a script is recovered from like anything else
+    unloaded = JavascriptException(
+        "javascript error: document unloaded while waiting for result")
+    assert classify(unloaded, driver()) == "timeout"
+    assert classify(JavascriptException("ReferenceError: NFBR is not defined"),
+                    driver("<p>ERROR998</p>")) == "error998"
+    assert classify(JavascriptException("target window already closed"),
+                    driver()) == "session"
+    assert classify(JavascriptException("renderer timed out"), driver()) == "crash"
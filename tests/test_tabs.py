@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+import pytest
+from selenium.common.exceptions import JavascriptException
+from bookphucker import tabs
+from bookphucker.capture import Frame, Navigation
+from bookphucker.tabs import Tabs
+
+
+class Driver:
+    """
+    Windows of a browser, `turned_away` ones show the ERROR998 page
+    """
+    current_url = "https://viewer.example/read"
+
+    def __init__(self, handles: list[str], turned_away: frozenset[str] = frozenset()):
+        self.handles = handles
+        self.turned_away = turned_away
+        self.current_window_handle = handles[0]
+        self.closed = list[str]()
+        self.switch_to = SimpleNamespace(window=self.switch)
+
+    def switch(self, handle: str):
+        self.current_window_handle = handle
+
+    @property
+    def page_source(self) -> str:
+        turned_away = self.current_window_handle in self.turned_away
+        return "<p>ERROR 998</p>" if turned_away else "<canvas></canvas>"
+
+    def execute_script(self, *args):
+        pass
+
+    def close(self):
+        self.closed.append(self.current_window_handle)
+
+
+def viewers(monkeypatch, driver: Driver) -> Tabs:
+    monkeypatch.setattr(Tabs, "limits", {})
+    cfg = SimpleNamespace(native_resolution=False, tabs=len(driver.handles),
+                          transport="png", precheck=False)
+    navigation = Navigation("() => 0", "target => {}")
+    viewer = Tabs(driver, navigation, cfg)  # type: ignore[arg-type]
+    viewer.handles = list(driver.handles)
+    for page, handle in enumerate(driver.handles, 1):
+        viewer.owner[page] = handle
+
+    def capture(driver: Driver, target: int, *args, **kwargs) -> Frame:
+        # the script of a viewer turned away fails with its page
+        if driver.current_window_handle in driver.turned_away:
+            raise JavascriptException("document unloaded while waiting for result")
+        return Frame([], "png", 1, 1)
+
+    monkeypatch.setattr(tabs, "capture", capture)
+    return viewer
+
+
+def test_grab_hands_over(monkeypatch):
+    driver = Driver(["a", "b"], turned_away=frozenset({"b"}))
+    viewer = viewers(monkeypatch, driver)
+    assert viewer.grab(2, retry=False) is not None
+    assert driver.closed == ["b"]
+    assert viewer.handles == ["a"]
+    assert viewer.owner[2] == "a"
+    assert Tabs.limits == {"viewer.example": 1}
+
+
+def test_grab_raises(monkeypatch):
+    # the last viewer has nobody to hand its pages to
+    viewer = viewers(monkeypatch, Driver(["a"], turned_away=frozenset({"a"})))
+    with pytest.raises(JavascriptException):
+        viewer.grab(1, retry=False)
+    # nor is a viewer the site did not turn away closed
+    driver = Driver(["a", "b"])
+    viewer = viewers(monkeypatch, driver)
+
+    def broken(*args, **kwargs):
+        raise JavascriptException("TypeError: x is undefined")
+
+    monkeypatch.setattr(tabs, "capture", broken)
+    with pytest.raises(JavascriptException):
+        viewer.grab(2, retry=False)
+    assert driver.closed == []
@@ -0,0 +1,35 @@
+import os
+import stat
+import pytest
+from bookphucker.utils import write_atomic
+
+
+def test_write_atomic(tmp_path):
+    path = tmp_path / "page_1.png"
+    write_atomic(path, b"first")
+    write_atomic(path, b"second")
+    assert path.read_bytes() == b"second"
+    assert [p.name for p in tmp_path.iterdir()] == ["page_1.png"]
+
+
+def test_write_atomic_mode(tmp_path):
+    # as open() would create it, not the 0600 of a temporary file
+    umask = os.umask(0)
+    os.umask(umask)
+    path = tmp_path / "meta.json"
+    write_atomic(path, b"{}")
+    assert stat.S_IMODE(path.stat().st_mode) == 0o666 & ~umask
+
+
+def test_write_atomic_failure(tmp_path, monkeypatch):
+    path = tmp_path / "page_1.png"
+    path.write_bytes(b"old")
+
+    def fsync(fd):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "fsync", fsync)
+    with pytest.raises(OSError):
+        write_atomic(path, b"new")
+    assert path.read_bytes() == b"old"
+    assert [p.name for p in tmp_path.iterdir()] == ["page_1.png"]